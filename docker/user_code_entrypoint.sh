@@ -0,0 +1,45 @@
+#!/usr/bin/env sh
+# user_code 容器启动脚本：
+# - DAGMA_WARM_WORKERS > 0 时在监督循环中启动预热工作进程池（dagma.warm_worker，端口 4100），
+#   进程池意外退出后自动重启（重启间隙 WarmWorkerRunLauncher 回退到默认启动器）；
+#   进程池与 gRPC 代码位置同生命周期：容器停止或代码位置退出时一并终止
+# - gRPC 代码位置（与 src/dagma/definitions.py 对齐）的退出码即容器退出码
+set -eu
+
+GRPC="dagster api grpc --module-name dagma.definitions --host 0.0.0.0 --port 4000"
+
+if [ "${DAGMA_WARM_WORKERS:-0}" -le 0 ]; then
+  # shellcheck disable=SC2086
+  exec $GRPC
+fi
+
+supervise_pool() {
+  child=""
+  trap '[ -n "$child" ] && kill -TERM "$child" 2>/dev/null; wait; exit 0' TERM INT
+  while :; do
+    python -m dagma.warm_worker --workers "${DAGMA_WARM_WORKERS}" &
+    child=$!
+    status=0
+    wait "$child" || status=$?
+    echo "warm worker pool exited with status ${status}; restarting in 2s" >&2
+    sleep 2
+  done
+}
+
+supervise_pool &
+pool_pid=$!
+# shellcheck disable=SC2086
+$GRPC &
+grpc_pid=$!
+
+trap 'kill -TERM "$grpc_pid" "$pool_pid" 2>/dev/null || true' TERM INT
+status=0
+wait "$grpc_pid" || status=$?
+# 收到信号时 wait 会提前返回：继续等待代码位置真正退出
+if kill -0 "$grpc_pid" 2>/dev/null; then
+  status=0
+  wait "$grpc_pid" || status=$?
+fi
+kill -TERM "$pool_pid" 2>/dev/null || true
+wait "$pool_pid" 2>/dev/null || true
+exit "$status"
@@ -0,0 +1,150 @@
+"""Qdrant collection 存储/索引选项基准：召回率、检索延迟与内存估算对比。
+
+用法（需要可访问的 Qdrant 服务，例如 make dev-up 或 bash scripts/start_env.sh up full）：
+
+    python scripts/bench_qdrant_collection.py --host localhost --port 6333 --n 20000 --dim 128
+
+对每组设置分别建 collection、写入同一份数据，等待索引完成（status=green）后：
+- recall@k：以 NumPy 精确余弦 top-k 为真值
+- 延迟：逐条检索的 p50 / p95（毫秒）
+- 内存：按向量/量化/HNSW 链接大小估算的常驻内存（on_disk 时原始向量不计入）
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import sys
+import time
+from typing import Any
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from dagma.defs.llm.resources import QdrantHttpResource  # noqa: E402
+
+SETTINGS: dict[str, dict[str, Any]] = {
+    "baseline": {},
+    "hnsw_m8": {"hnsw_m": 8, "hnsw_ef_construct": 64},
+    "hnsw_m32": {"hnsw_m": 32, "hnsw_ef_construct": 200},
+    "scalar": {"quantization": "scalar"},
+    "scalar_on_disk": {"quantization": "scalar", "on_disk": True},
+    "product_on_disk": {"quantization": "product", "on_disk": True},
+}
+
+
+def make_data(n: int, dim: int, queries: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """高斯混合数据（比纯随机更接近真实嵌入的聚簇分布）。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(64, dim))
+    data = centers[rng.integers(0, 64, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    q = centers[rng.integers(0, 64, size=queries)] + 0.3 * rng.normal(size=(queries, dim))
+    return data.astype(np.float32), q.astype(np.float32)
+
+
+def exact_topk(data: np.ndarray, queries: np.ndarray, k: int) -> list[set[int]]:
+    dn = data / np.linalg.norm(data, axis=1, keepdims=True)
+    qn = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = qn @ dn.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def estimate_ram_bytes(n: int, dim: int, options: dict[str, Any]) -> int:
+    m = options.get("hnsw_m") or 16  # Qdrant 默认 m=16
+    raw = 0 if options.get("on_disk") else n * dim * 4
+    quant = {"scalar": n * dim, "product": n * dim * 4 // 16}.get(options.get("quantization"), 0)
+    links = n * m * 2 * 4  # 第 0 层约 2m 条 4 字节链接
+    return raw + quant + links
+
+
+def wait_green(r: QdrantHttpResource, timeout: float = 600.0) -> None:
+    end = time.time() + timeout
+    while time.time() < end:
+        info = r._request("GET", f"/collections/{r.collection}") or {}
+        if info.get("result", {}).get("status") == "green":
+            return
+        time.sleep(1.0)
+    raise TimeoutError(f"collection {r.collection} not green after {timeout}s")
+
+
+def run_setting(
+    name: str, options: dict[str, Any], data: np.ndarray, queries: np.ndarray, truth, args
+) -> dict[str, Any]:
+    r = QdrantHttpResource(
+        host=args.host, port=args.port, collection=f"bench_{name}", timeout=args.timeout
+    )
+    try:
+        r._request("DELETE", f"/collections/{r.collection}")
+    except RuntimeError:
+        pass
+    # 降低 indexing_threshold，保证小数据集也会构建 HNSW 索引
+    r.ensure_collection(
+        size=data.shape[1],
+        distance="Cosine",
+        optimizers_config={"indexing_threshold": 1},
+        **options,
+    )
+    for start in range(0, len(data), args.batch):
+        chunk = data[start : start + args.batch]
+        r.upsert({"id": start + i, "vector": v.tolist()} for i, v in enumerate(chunk))
+    wait_green(r)
+
+    params: dict[str, Any] = {"hnsw_ef": args.hnsw_ef}
+    if options.get("quantization"):
+        params["quantization"] = {"rescore": True}
+    latencies, hits = [], 0
+    for q, expected in zip(queries, truth, strict=True):
+        t0 = time.perf_counter()
+        res = r.search(q.tolist(), limit=args.k, with_payload=False, search_params=params)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += len({h["id"] for h in res} & expected)
+    if not args.keep:
+        r._request("DELETE", f"/collections/{r.collection}")
+
+    lat = np.asarray(latencies)
+    return {
+        "setting": name,
+        "recall": round(hits / (args.k * len(queries)), 4),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+        "ram_mb_est": round(estimate_ram_bytes(len(data), data.shape[1], options) / 2**20, 1),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="localhost")
+    ap.add_argument("--port", type=int, default=6333)
+    ap.add_argument("--n", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=128)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--hnsw-ef", type=int, default=64)
+    ap.add_argument("--batch", type=int, default=1000)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--only", nargs="*", choices=sorted(SETTINGS), help="仅运行指定设置")
+    ap.add_argument("--keep", action="store_true", help="保留基准 collection 便于排查")
+    ap.add_argument("--json", dest="json_path", help="将结果写入 JSON 文件")
+    args = ap.parse_args()
+
+    data, queries = make_data(args.n, args.dim, args.queries)
+    truth = exact_topk(data, queries, args.k)
+    rows = [
+        run_setting(name, SETTINGS[name], data, queries, truth, args)
+        for name in (args.only or SETTINGS)
+    ]
+
+    print(f"{'setting':<18}{'recall@' + str(args.k):>10}{'p50_ms':>9}{'p95_ms':>9}{'ram_mb':>9}")
+    for row in rows:
+        print(
+            f"{row['setting']:<18}{row['recall']:>10}{row['p50_ms']:>9}"
+            f"{row['p95_ms']:>9}{row['ram_mb_est']:>9}"
+        )
+    if args.json_path:
+        pathlib.Path(args.json_path).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
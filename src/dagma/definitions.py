@@ -6,69 +6,182 @@
 from __future__ import annotations
 
 import os
+from typing import Any
 
-from dagster import Definitions, ScheduleDefinition, define_asset_job, load_assets_from_modules
+from dagster import (
+    AssetSelection,
+    AutomationConditionSensorDefinition,
+    ConfigurableResource,
+    DefaultSensorStatus,
+    Definitions,
+    ScheduleDefinition,
+    define_asset_job,
+    in_process_executor,
+    load_assets_from_modules,
+)
 
 from .defs.core.resources import BasePathResource
 from .defs.data import assets as data_assets
+from .defs.data.partitions import daily_partitions
 from .defs.llm import assets as llm_assets
 from .defs.llm import resources as llm_resources
 from .defs.models import assets as model_assets
 from .defs.models import resources as model_resources
+from .defs.models import sensors as model_sensors
 from .defs.viz import assets as viz_assets
 from .defs.viz import resources as viz_resources
 
 all_assets = load_assets_from_modules([data_assets, model_assets, llm_assets, viz_assets])
 
+_base_path_resource = BasePathResource()
+
 # 通过环境变量切换 MLflow 资源（最佳实践：默认使用 Stub，生产/联调时显式打开）
+# MLFLOW_TRACKING_MODE=local 时先写本地追加日志，run 结束后再批量异步同步到 Tracking 服务
 _use_tracking = os.getenv("MLFLOW_USE_TRACKING", "").lower() in {"1", "true", "yes"}
-_mlflow_resource = (
-    model_resources.MlflowTrackingResource()
-    if _use_tracking
-    else model_resources.MlflowStubResource()
-)
+_mlflow_resource: ConfigurableResource
+_mlflow_sensors = []
+if not _use_tracking:
+    _mlflow_resource = model_resources.MlflowStubResource()
+elif os.getenv("MLFLOW_TRACKING_MODE", "remote").lower() == "local":
+    _mlflow_resource = model_resources.MlflowLocalFirstResource(base_path=_base_path_resource)
+    # 定期补偿同步：进程退出前未完成或写入进程崩溃的本地 run
+    _mlflow_sensors.append(model_sensors.mlflow_local_sync_sensor)
+else:
+    _mlflow_resource = model_resources.MlflowTrackingResource()
 
 # LangFlow 资源：从环境变量读取连接参数，保持安全与可迁移性
-_langflow_resource = llm_resources.LangflowRestResource(
-    base_url=os.getenv("LANGFLOW_BASE_URL", "http://localhost:7860"),
-    api_key=os.getenv("LANGFLOW_API_KEY"),
-    default_flow_id=os.getenv("LANGFLOW_DEFAULT_FLOW_ID"),
-)
+_langflow_kwargs: dict[str, Any] = {
+    "base_url": os.getenv("LANGFLOW_BASE_URL", "http://localhost:7860"),
+    "api_key": os.getenv("LANGFLOW_API_KEY"),
+    "default_flow_id": os.getenv("LANGFLOW_DEFAULT_FLOW_ID"),
+}
+_langflow_resource: llm_resources.LangflowRestResource
+# LANGFLOW_CACHE=true 时在 run_flow 前加一层持久化响应缓存（SQLite，位于 base_path 下）
+if os.getenv("LANGFLOW_CACHE", "").lower() in {"1", "true", "yes"}:
+    _similarity = os.getenv("LANGFLOW_CACHE_SIMILARITY")
+    _langflow_resource = llm_resources.CachedLangflowResource(
+        **_langflow_kwargs,
+        base_path=_base_path_resource,
+        cache_ttl_s=float(os.getenv("LANGFLOW_CACHE_TTL", str(7 * 24 * 3600))),
+        similarity_threshold=float(_similarity) if _similarity else None,
+    )
+else:
+    _langflow_resource = llm_resources.LangflowRestResource(**_langflow_kwargs)
+
+# 向量库资源：默认 Qdrant REST；LLM_VECTOR_BACKEND=local 时使用进程内索引（本地/CI 无需 Qdrant）
+_vector_backend = os.getenv("LLM_VECTOR_BACKEND", "qdrant").lower()
+_vector_resource: ConfigurableResource
+if _vector_backend == "local":
+    _vector_resource = llm_resources.LocalVectorIndexResource(
+        base_path=_base_path_resource,
+        collection=os.getenv("QDRANT_COLLECTION", "embeddings"),
+        index_type=os.getenv("LOCAL_VECTOR_INDEX_TYPE", "flat"),
+    )
+elif os.getenv("QDRANT_SHARDS"):
+    # 分片布局：逗号分隔的 [host[:port]/]collection，未写主机时使用 QDRANT_HOST/QDRANT_PORT
+    _shards = []
+    for _spec in filter(None, (x.strip() for x in os.environ["QDRANT_SHARDS"].split(","))):
+        _loc, _, _coll = _spec.rpartition("/")
+        _host, _, _port = _loc.partition(":")
+        _shards.append(
+            llm_resources.QdrantShardConfig(
+                host=_host or os.getenv("QDRANT_HOST", "localhost"),
+                port=int(_port or os.getenv("QDRANT_PORT", "6333")),
+                use_https=os.getenv("QDRANT_USE_HTTPS", "false").lower() in {"1", "true", "yes"},
+                api_key=os.getenv("QDRANT_API_KEY"),
+                collection=_coll,
+            )
+        )
+    _vector_resource = llm_resources.ShardedQdrantResource(
+        shards=_shards,
+        routing=os.getenv("QDRANT_SHARD_ROUTING", "hash"),
+        timeout=float(os.getenv("QDRANT_TIMEOUT", "30")),
+    )
+else:
+    # Qdrant 资源：从环境变量读取，容器内请设置 QDRANT_HOST=qdrant
+    _vector_resource = llm_resources.QdrantHttpResource(
+        host=os.getenv("QDRANT_HOST", "localhost"),
+        port=int(os.getenv("QDRANT_PORT", "6333")),
+        use_https=os.getenv("QDRANT_USE_HTTPS", "false").lower() in {"1", "true", "yes"},
+        api_key=os.getenv("QDRANT_API_KEY"),
+        collection=os.getenv("QDRANT_COLLECTION", "embeddings"),
+        timeout=float(os.getenv("QDRANT_TIMEOUT", "30")),
+        # 可选的索引/量化/存储参数（未设置时使用 Qdrant 默认值）
+        hnsw_m=int(os.environ["QDRANT_HNSW_M"]) if os.getenv("QDRANT_HNSW_M") else None,
+        hnsw_ef_construct=(
+            int(os.environ["QDRANT_HNSW_EF_CONSTRUCT"])
+            if os.getenv("QDRANT_HNSW_EF_CONSTRUCT")
+            else None
+        ),
+        quantization=os.getenv("QDRANT_QUANTIZATION") or None,
+        on_disk=(
+            os.environ["QDRANT_ON_DISK"].lower() in {"1", "true", "yes"}
+            if os.getenv("QDRANT_ON_DISK")
+            else None
+        ),
+        on_drift=os.getenv("QDRANT_ON_DRIFT", "warn"),
+    )
 
-# Qdrant 资源：从环境变量读取，容器内请设置 QDRANT_HOST=qdrant
-_qdrant_resource = llm_resources.QdrantHttpResource(
-    host=os.getenv("QDRANT_HOST", "localhost"),
-    port=int(os.getenv("QDRANT_PORT", "6333")),
-    use_https=os.getenv("QDRANT_USE_HTTPS", "false").lower() in {"1", "true", "yes"},
-    api_key=os.getenv("QDRANT_API_KEY"),
-    collection=os.getenv("QDRANT_COLLECTION", "embeddings"),
-    timeout=float(os.getenv("QDRANT_TIMEOUT", "30")),
+# 跨运行的嵌入缓存（按模型与文本哈希复用向量）；容量以 MB 计，超出按 LRU 淘汰
+_embedding_cache_resource = llm_resources.EmbeddingCacheResource(
+    base_path=_base_path_resource,
+    max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024),
 )
 
+# 短作业使用进程内执行器：默认多进程执行器会为每个步骤 spawn 新进程并重新导入代码位置，
+# 抵消预热工作进程池（dagma.warm_worker）省下的启动开销；其 job_names 应只包含这些作业
+_short_job_kwargs: dict[str, Any] = {"executor_def": in_process_executor}
+
 # 为 LangFlow 资产创建最小作业与调度（每日 02:00 触发）
-run_langflow_job = define_asset_job("run_langflow_job", selection=["langflow_run_flow"])
+run_langflow_job = define_asset_job(
+    "run_langflow_job", selection=["langflow_run_flow"], **_short_job_kwargs
+)
 run_langflow_daily = ScheduleDefinition(
     name="run_langflow_daily", job=run_langflow_job, cron_schedule="0 2 * * *"
 )
 
 # 示例作业：最小 RAG 链与模型训练（便于 UI/CLI 快速触发验证）
 run_llm_rag_job = define_asset_job(
-    "run_llm_rag_job", selection=["embed_texts_stub", "qdrant_upsert", "qdrant_search"]
+    "run_llm_rag_job",
+    selection=["embed_texts_stub", "embed_query_vector", "qdrant_upsert", "qdrant_search"],
+    **_short_job_kwargs,
+)
+run_models_train_job = define_asset_job(
+    "run_models_train_job", selection=["train_model_stub"], **_short_job_kwargs
+)
+# LangFlow 批处理作业（按日分区，输入数据集来自 langflow_batch_inputs）
+run_langflow_batch_job = define_asset_job(
+    "run_langflow_batch_job", selection=["langflow_batch_run"], partitions_def=daily_partitions
+)
+
+# 声明式自动物化：评估各资产的 automation_condition（见 core/automation.on_inputs_changed），
+# 仅在缺失、代码版本或上游数据版本变化时发起运行，避免固定周期的无效重算。
+# 条件含 newly_missing：首次部署即会物化全部资产（写入 Qdrant、创建 MLflow run），
+# 因此默认停止，需在 UI 中手动开启或设置 DAGMA_AUTOMATION=true
+_automation_enabled = os.getenv("DAGMA_AUTOMATION", "").lower() in {"1", "true", "yes"}
+dagma_automation_sensor = AutomationConditionSensorDefinition(
+    "dagma_automation_sensor",
+    target=AssetSelection.all(),
+    default_status=(
+        DefaultSensorStatus.RUNNING if _automation_enabled else DefaultSensorStatus.STOPPED
+    ),
+    minimum_interval_seconds=60,
 )
-run_models_train_job = define_asset_job("run_models_train_job", selection=["train_model_stub"])
 
 
 defs = Definitions(
     assets=all_assets,
     resources={
-        "base_path": BasePathResource(),
+        "base_path": _base_path_resource,
         "mlflow": _mlflow_resource,
-        # 将 llm 资源键统一指向 Qdrant REST 客户端
-        "llm": _qdrant_resource,
+        # 将 llm 资源键统一指向向量库客户端（Qdrant REST 或本地索引，API 一致）
+        "llm": _vector_resource,
         # LangFlow 独立资源键，供 langflow_run_flow 使用
         "langflow": _langflow_resource,
+        "embedding_cache": _embedding_cache_resource,
         "dashboard": viz_resources.DashboardStubResource(),
     },
     schedules=[run_langflow_daily],
-    jobs=[run_langflow_job, run_llm_rag_job, run_models_train_job],
+    sensors=[dagma_automation_sensor, *_mlflow_sensors],
+    jobs=[run_langflow_job, run_llm_rag_job, run_models_train_job, run_langflow_batch_job],
 )
@@ -1,3 +1,3 @@
 """核心资源模块（M1：仅提供基础可配置资源示例）。"""
 
-__all__ = ["resources"]
+__all__ = ["automation", "profiling", "resources"]
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any
+
+from dagster import AutomationCondition, DataVersion
+
+
+def content_data_version(value: Any) -> DataVersion:
+    """基于内容哈希生成数据版本：内容不变则版本不变，下游据此判断是否需要重算。"""
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return DataVersion(hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16])
+
+
+def on_inputs_changed() -> AutomationCondition:
+    """声明式自动物化条件：仅当输入真正变化时触发，跳过无效重算。
+
+    触发（自上次处理以来任一成立）：
+    - 资产新出现缺失（首次部署/被删除）
+    - 资产 code_version 变化（代码变更）
+    - 任一上游的数据版本变化（配合 content_data_version，内容相同的重物化不会触发）
+
+    抑制：上游缺失、上游或自身正在运行时不触发。
+    """
+    # 显式标注为 AutomationCondition：`|` 的推断类型与 since_last_handled 的 self 类型不兼容
+    changed: AutomationCondition = (
+        AutomationCondition.newly_missing()
+        | AutomationCondition.code_version_changed()
+        | AutomationCondition.any_deps_match(AutomationCondition.data_version_changed())
+    )
+    trigger = changed.since_last_handled()
+    return (
+        trigger
+        & ~AutomationCondition.any_deps_missing()
+        & ~AutomationCondition.any_deps_in_progress()
+        & ~AutomationCondition.in_progress()
+    ).with_label("on_inputs_changed")
+
+
+__all__ = ["content_data_version", "on_inputs_changed"]
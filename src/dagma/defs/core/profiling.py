@@ -0,0 +1,166 @@
+"""按需启用的资产级性能剖析：采样式 CPU 剖析 + tracemalloc 峰值内存。
+
+启用方式（任一即可，默认关闭，关闭时仅多一次开关判断）：
+- 环境变量 DAGMA_PROFILE=1（对进程内所有运行生效）
+- 运行标签 dagma/profile=1（仅对该次运行生效，可在 UI Launchpad 中添加）
+
+启用后每次执行资产写入 <base_path>/profiles/<run_id>/<op>.folded（folded stacks 格式，
+可直接用 flamegraph.pl 或 speedscope 打开），并把文件路径、CPU/墙钟时间与内存峰值
+作为物化元数据附加到本次选中的各资产上。
+"""
+
+from __future__ import annotations
+
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+from dagster import AssetExecutionContext, MetadataValue, get_dagster_logger
+
+from .resources import BasePathResource
+
+PROFILE_ENV = "DAGMA_PROFILE"
+PROFILE_TAG = "dagma/profile"
+# 采样间隔（毫秒），越小越精细、开销越大
+PROFILE_INTERVAL_ENV = "DAGMA_PROFILE_INTERVAL_MS"
+
+_TRUTHY = {"1", "true", "yes"}
+
+
+class StackSampler:
+    """后台线程按固定间隔采样目标线程的调用栈，聚合为 folded stacks。
+
+    只统计 root 帧之上的栈（即资产函数体内部），root 不在栈上时的样本丢弃。
+    """
+
+    def __init__(self, thread_id: int, root: FrameType, interval_s: float = 0.005) -> None:
+        self.thread_id = thread_id
+        self.root = root
+        self.interval_s = interval_s
+        self.counts: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="dagma-profiler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: list[str] = []
+            while frame is not None and frame is not self.root:
+                code = frame.f_code
+                name = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+                stack.append(name.replace(";", ":"))
+                frame = frame.f_back
+            if frame is self.root and stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path: Path) -> None:
+        lines = [f"{stack} {n}" for stack, n in self.counts.most_common()]
+        path.write_text("\n".join(lines) + ("\n" if lines else ""), encoding="utf-8")
+
+
+def profiling_enabled(context: AssetExecutionContext) -> bool:
+    if os.getenv(PROFILE_ENV, "").lower() in _TRUTHY:
+        return True
+    return str(context.run.tags.get(PROFILE_TAG, "")).lower() in _TRUTHY
+
+
+def _profile_dir(context: AssetExecutionContext) -> Path:
+    # 资产声明了 base_path 资源时沿用其配置，否则使用默认根目录（与 definitions 一致）
+    base_path = getattr(context.resources, "base_path", None)
+    if not isinstance(base_path, BasePathResource):
+        base_path = BasePathResource()
+    return base_path.ensure_dir("profiles", context.run.run_id)
+
+
+class _Profile:
+    """单次资产执行的剖析会话：采样线程 + tracemalloc + CPU/墙钟计时。"""
+
+    def __init__(self, context: AssetExecutionContext, root: FrameType) -> None:
+        self.context = context
+        interval_ms = float(os.getenv(PROFILE_INTERVAL_ENV, "5"))
+        self.sampler = StackSampler(threading.get_ident(), root, interval_ms / 1000.0)
+
+    def __enter__(self) -> _Profile:
+        self._own_tracing = not tracemalloc.is_tracing()
+        if self._own_tracing:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        self._cpu0 = time.thread_time()
+        self._wall0 = time.perf_counter()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.sampler.stop()
+        cpu_s = time.thread_time() - self._cpu0
+        wall_s = time.perf_counter() - self._wall0
+        _, peak = tracemalloc.get_traced_memory()
+        if self._own_tracing:
+            tracemalloc.stop()
+        path = _profile_dir(self.context) / f"{self.context.op_def.name}.folded"
+        self.sampler.write_folded(path)
+        self.metadata = {
+            "profile_folded": MetadataValue.path(str(path)),
+            "profile_samples": sum(self.sampler.counts.values()),
+            "profile_cpu_s": round(cpu_s, 4),
+            "profile_wall_s": round(wall_s, 4),
+            "profile_peak_mem_mb": round(peak / 2**20, 3),
+        }
+        get_dagster_logger().info("profile written to %s (%s)", path, self.metadata)
+
+    def attach(self) -> None:
+        for key in self.context.selected_asset_keys:
+            self.context.add_asset_metadata(self.metadata, asset_key=key)
+
+
+def profiled(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """资产函数装饰器（置于 @asset / @multi_asset 之下），按需开启剖析。
+
+    生成器资产会先缓冲产出的事件，剖析结束、元数据附加后再依次产出。
+    """
+    if inspect.isgeneratorfunction(fn):
+
+        @functools.wraps(fn)
+        def gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+            context = AssetExecutionContext.get()
+            if not profiling_enabled(context):
+                yield from fn(*args, **kwargs)
+                return
+            with _Profile(context, sys._getframe()) as prof:
+                events = list(fn(*args, **kwargs))
+            prof.attach()
+            yield from events
+
+        return gen_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        context = AssetExecutionContext.get()
+        if not profiling_enabled(context):
+            return fn(*args, **kwargs)
+        with _Profile(context, sys._getframe()) as prof:
+            result = fn(*args, **kwargs)
+        prof.attach()
+        return result
+
+    return wrapper
+
+
+__all__ = ["PROFILE_ENV", "PROFILE_TAG", "StackSampler", "profiled", "profiling_enabled"]
@@ -2,8 +2,12 @@ from __future__ import annotations
 
 from dagster import MaterializeResult, MetadataValue, asset
 
+from ..core.automation import content_data_version, on_inputs_changed
+from ..core.profiling import profiled
 
-@asset(group_name="data", description="生成一个最小示例数据集：一组整数。")
+
+@asset(group_name="data", code_version="1", description="生成一个最小示例数据集：一组整数。")
+@profiled
 def raw_numbers() -> MaterializeResult[list[int]]:
     data = [1, 2, 3]
     # 附加观测性元数据：记录数量与样本
@@ -13,10 +17,17 @@ def raw_numbers() -> MaterializeResult[list[int]]:
             "count": len(data),
             "preview": MetadataValue.json(data),
         },
+        data_version=content_data_version(data),
     )
 
 
-@asset(group_name="data", description="计算整数列表的和，演示资产依赖。")
+@asset(
+    group_name="data",
+    code_version="1",
+    automation_condition=on_inputs_changed(),
+    description="计算整数列表的和，演示资产依赖。",
+)
+@profiled
 def sum_numbers(raw_numbers: list[int]) -> MaterializeResult[int]:  # noqa: D401
     total = sum(raw_numbers)
     # 附加观测性元数据：输入规模与结果摘要
@@ -26,6 +37,7 @@ def sum_numbers(raw_numbers: list[int]) -> MaterializeResult[int]:  # noqa: D401
             "input_count": len(raw_numbers),
             "result": total,
         },
+        data_version=content_data_version(total),
     )
 
 
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from dagster import StaticPartitionsDefinition
+from dagster import DailyPartitionsDefinition, StaticPartitionsDefinition
 
 # 示例静态分区定义（M1 不强制使用，仅作为后续扩展示例）
 small_static_partitions = StaticPartitionsDefinition(["train", "test"])
 
-__all__ = ["small_static_partitions"]
+# 按天分区：批处理类资产（如 LangFlow 批量调用）按日落盘输出
+daily_partitions = DailyPartitionsDefinition(start_date="2025-01-01")
+
+__all__ = ["small_static_partitions", "daily_partitions"]
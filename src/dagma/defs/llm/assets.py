@@ -1,87 +1,189 @@
-from __future__ import annotations
+# 注意：本模块不使用 from __future__ import annotations——Dagster 需要在定义期读取
+# Config 参数（如 LangflowBatchConfig）的真实类型注解，字符串注解无法被解析。
+import json
+import os
+import time
+from collections.abc import Iterator
+from typing import Any
 
-from dagster import MaterializeResult, MetadataValue, asset, get_dagster_logger
+from dagster import (
+    AssetExecutionContext,
+    AssetOut,
+    Config,
+    MaterializeResult,
+    MetadataValue,
+    Output,
+    ResourceParam,
+    asset,
+    get_dagster_logger,
+    multi_asset,
+)
 
-from .resources import LangflowRestResource, QdrantHttpResource
+from ..core.automation import content_data_version, on_inputs_changed
+from ..core.profiling import profiled
+from ..core.resources import BasePathResource
+from ..data.partitions import daily_partitions
+from .resources import EmbeddingCacheResource, LangflowRestResource
 
 
 @asset(group_name="llm", description="LLM 占位资产，不做任何调用。")
+@profiled
 def llm_placeholder() -> str:
     return "placeholder"
 
 
 # ===== 最小 RAG 资产链：向量化 -> 写入 -> 检索 =====
-@asset(
-    group_name="llm",
-    description="简易文本嵌入（占位实现）：将每个字符映射为 ord 值并归一化，维度为 8。",
-)
-def embed_texts_stub() -> tuple[list[list[float]], list[dict]]:
-    """返回 (vectors, payloads)。
+# 嵌入模型标识：更换模型或特征逻辑时必须修改，旧缓存随之失效（按 model_id 分目录）
+_EMBED_MODEL_ID = "stub-ord-8"
 
-    - vectors: list[8-dim float]
-    - payloads: 与向量对应的元数据（含 text）
-    """
-    texts = ["hello world", "dagma project", "qdrant vector db", "langflow ui"]
-    dim = 8
+
+def _embed_stub(texts: list[str], dim: int = 8) -> list[list[float]]:
     vectors: list[list[float]] = []
-    payloads: list[dict] = []
     for t in texts:
         vals = [ord(c) % 97 for c in t[:dim]]  # 取前 dim 个字符的数值特征
         if len(vals) < dim:
             vals += [0] * (dim - len(vals))
         # 简单归一化到 [0,1]
         m = max(1, max(vals))
-        vec = [v / m for v in vals]
-        vectors.append(vec)
-        payloads.append({"text": t})
-    return vectors, payloads
+        vectors.append([v / m for v in vals])
+    return vectors
+
+
+@multi_asset(
+    group_name="llm",
+    outs={
+        "embed_texts_stub": AssetOut(
+            is_required=False,
+            code_version="1",
+            automation_condition=on_inputs_changed(),
+            description="简易文本嵌入（占位实现）：将每个字符映射为 ord 值并归一化，维度为 8。",
+        ),
+        "embed_query_vector": AssetOut(
+            is_required=False,
+            code_version="1",
+            automation_condition=on_inputs_changed(),
+            description="检索用查询向量（仅第一条文本），供 qdrant_search 单独加载。",
+        ),
+    },
+    can_subset=True,
+)
+@profiled
+def embed_texts_stub(
+    context: AssetExecutionContext, embedding_cache: EmbeddingCacheResource
+) -> Iterator[Output]:
+    """产出 embed_texts_stub = (vectors, payloads) 与 embed_query_vector = vectors[0]。
 
+    - vectors: list[8-dim float]
+    - payloads: 与向量对应的元数据（含 text）
 
-@asset(group_name="llm", description="将向量写入 Qdrant（REST）。")
+    拆分为两个输出后，下游检索只加载所需的查询向量，而非整份嵌入；支持按输出子集物化。
+    向量经 embedding_cache 跨运行复用，仅对未命中的文本分批计算。
+    """
+    texts = ["hello world", "dagma project", "qdrant vector db", "langflow ui"]
+    selected = context.op_execution_context.selected_output_names
+    # 仅物化查询向量时只需第一条文本
+    needed = texts if "embed_texts_stub" in selected else texts[:1]
+    matrix, stats = embedding_cache.get_or_embed(needed, _embed_stub, model_id=_EMBED_MODEL_ID)
+    vectors: list[list[float]] = matrix.tolist()
+    lookups = stats["hits"] + stats["misses"]
+    cache_md = {
+        "embedding_cache_hits": stats["hits"],
+        "embedding_cache_misses": stats["misses"],
+        "embedding_cache_hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+        "embedding_cache_evictions": stats["evictions"],
+    }
+    if "embed_texts_stub" in selected:
+        payloads: list[dict] = [{"text": t} for t in texts]
+        yield Output(
+            (vectors, payloads),
+            output_name="embed_texts_stub",
+            metadata={
+                "count": len(vectors),
+                "dim": len(vectors[0]) if vectors else 0,
+                "embedding_model": _EMBED_MODEL_ID,
+                **cache_md,
+            },
+            data_version=content_data_version([vectors, payloads]),
+        )
+    if "embed_query_vector" in selected:
+        yield Output(
+            vectors[0] if vectors else [],
+            output_name="embed_query_vector",
+            metadata={"query_text": texts[0] if texts else "", **cache_md},
+            data_version=content_data_version(vectors[:1]),
+        )
+
+
+class QdrantCollectionConfig(Config):
+    """collection 存储/索引选项；未设置的项沿用资源字段或服务端默认值。"""
+
+    hnsw_m: int | None = None
+    hnsw_ef_construct: int | None = None
+    # scalar | product
+    quantization: str | None = None
+    on_disk: bool | None = None
+    optimizers_config: dict[str, int] | None = None
+
+
+@asset(
+    group_name="llm",
+    code_version="1",
+    automation_condition=on_inputs_changed(),
+    description="将向量写入 Qdrant（REST）或本地向量索引。",
+)
+@profiled
 def qdrant_upsert(
-    embed_texts_stub: tuple[list[list[float]], list[dict]], llm: QdrantHttpResource
+    config: QdrantCollectionConfig,
+    embed_texts_stub: tuple[list[list[float]], list[dict]],
+    llm: ResourceParam[Any],
 ) -> MaterializeResult[dict]:
     vectors, payloads = embed_texts_stub
     dim = len(vectors[0]) if vectors else 0
-    # 幂等创建集合
-    llm.ensure_collection(size=dim, distance="Cosine")
+    # 幂等创建集合，并检测已有集合与请求配置的漂移
+    options = {k: v for k, v in config.model_dump().items() if v is not None}
+    ensured = llm.ensure_collection(size=dim, distance="Cosine", **options)
+    drift = (ensured.get("drift") or {}) if isinstance(ensured, dict) else {}
 
     points = []
     for i, (vec, pl) in enumerate(zip(vectors, payloads, strict=False), start=1):
         points.append({"id": i, "vector": vec, "payload": pl})
     resp = llm.upsert(points)
 
-    # 组装 Qdrant REST 链接（便于健康性验证与排障）
-    scheme = "https" if llm.use_https else "http"
-    base = f"{scheme}://{llm.host}:{llm.port}"
-    coll_url = f"{base}/collections/{llm.collection}"
+    # 组装 collection 链接（Qdrant 为 REST 地址，本地索引为 file:// 目录，便于排障）
+    coll_url = llm.collection_url()
 
     return MaterializeResult(
         value={"count": len(points), "result": resp},
         metadata={
             "points_count": len(points),
+            "collection_options": MetadataValue.json(options),
+            "collection_drift": MetadataValue.json(drift),
             "collection": llm.collection,
             "qdrant_collection_url": MetadataValue.url(coll_url),
         },
+        # 版本取决于写入内容而非服务端响应（operation_id 每次不同）
+        data_version=content_data_version(points),
     )
 
 
-@asset(group_name="llm", description="使用第一条向量进行近邻检索，返回 top-3。")
+@asset(
+    group_name="llm",
+    # 仅需保证写入先于检索：以 deps 声明顺序依赖，不经 IO manager 加载 qdrant_upsert 的返回值
+    deps=["qdrant_upsert"],
+    description="使用查询向量进行近邻检索，返回 top-3。",
+)
+@profiled
 def qdrant_search(
-    qdrant_upsert: dict,
-    embed_texts_stub: tuple[list[list[float]], list[dict]],
-    llm: QdrantHttpResource,
+    embed_query_vector: list[float],
+    llm: ResourceParam[Any],
 ) -> MaterializeResult[list[dict]]:
-    vectors, _payloads = embed_texts_stub
-    if not vectors:
+    if not embed_query_vector:
         return MaterializeResult(value=[])
     log = get_dagster_logger()
-    results = llm.search(vectors[0], limit=3, with_payload=True)
+    results = llm.search(embed_query_vector, limit=3, with_payload=True)
     log.info("qdrant_search top3=%s", results)
 
-    scheme = "https" if llm.use_https else "http"
-    base = f"{scheme}://{llm.host}:{llm.port}"
-    search_ep = f"{base}/collections/{llm.collection}/points/search"
+    search_ep = llm.collection_url("/points/search")
 
     return MaterializeResult(
         value=results,
@@ -94,9 +196,12 @@ def qdrant_search(
 
 
 @asset(group_name="llm", description="通过 LangFlow REST 调用指定 Flow（最小示例）。")
+@profiled
 def langflow_run_flow(langflow: LangflowRestResource) -> MaterializeResult[dict]:
     """最小可用：如果未配置 default_flow_id，则标记跳过；否则直接调用并记录关键信息。"""
     log = get_dagster_logger()
+    # 兼容：仅 CachedLangflowResource 提供 cache_stats，使用鸭子类型判断
+    stats_before = langflow.cache_stats() if hasattr(langflow, "cache_stats") else None
     resp = langflow.run_flow(input_value="ping from dagma", output_type="chat", input_type="chat")
     # 记录关键信息，避免打印过大响应
     summary = {
@@ -118,6 +223,116 @@ def langflow_run_flow(langflow: LangflowRestResource) -> MaterializeResult[dict]
                 ui_base if isinstance(ui_base, str) else "http://localhost:7860"
             ),
             "default_flow_id": getattr(langflow, "default_flow_id", None),
+            **_cache_metadata(langflow, stats_before),
+        },
+    )
+
+
+def _cache_metadata(langflow: Any, stats_before: dict | None) -> dict[str, Any]:
+    """对比调用前后的缓存统计，生成本次物化的缓存命中元数据（无缓存时返回空）。"""
+    if stats_before is None:
+        return {}
+    after = langflow.cache_stats()
+    hits_before = stats_before["hits"] + stats_before["semantic_hits"]
+    return {
+        "cache_hits": after["hits"] + after["semantic_hits"] - hits_before,
+        "cache_misses": after["misses"] - stats_before["misses"],
+        "cache_hit_rate_total": round(after["hit_rate"], 4),
+        "cache_entries": after["entries"],
+    }
+
+
+# ===== LangFlow 批处理：数据集输入 -> 有界并发调用 -> 按分区落盘 =====
+_SAMPLE_BATCH_INPUTS = ["hello from dagma", "summarize dagster assets", "what is a vector db"]
+
+
+@asset(
+    group_name="llm",
+    description="LangFlow 批处理输入：读取 base_path 下 langflow/batch_inputs.txt（每行一条）。",
+)
+@profiled
+def langflow_batch_inputs(base_path: BasePathResource) -> MaterializeResult[list[str]]:
+    """文件不存在时回退为示例输入，便于本地直接运行。"""
+    src = base_path.resolve("langflow", "batch_inputs.txt")
+    if src.exists():
+        lines = src.read_text(encoding="utf-8").splitlines()
+        inputs = [line.strip() for line in lines if line.strip()]
+    else:
+        inputs = list(_SAMPLE_BATCH_INPUTS)
+    return MaterializeResult(
+        value=inputs,
+        metadata={
+            "count": len(inputs),
+            "source": str(src) if src.exists() else "sample",
+            "preview": MetadataValue.json(inputs[:5]),
+        },
+    )
+
+
+class LangflowBatchConfig(Config):
+    flow_id: str | None = None
+    concurrency: int = 4
+    # 每秒请求数上限，<= 0 表示不限速
+    rate_limit_per_s: float = 0.0
+    # 非空时整批复用同一 LangFlow 会话
+    session_id: str | None = None
+
+
+@asset(
+    group_name="llm",
+    partitions_def=daily_partitions,
+    description="以有界并发批量调用 LangFlow Flow，结果按日分区流式写入 JSONL。",
+)
+@profiled
+def langflow_batch_run(
+    context: AssetExecutionContext,
+    config: LangflowBatchConfig,
+    langflow_batch_inputs: list[str],
+    langflow: LangflowRestResource,
+    base_path: BasePathResource,
+) -> MaterializeResult[dict]:
+    """逐条完成即写入 langflow_batch/<partition>/results.jsonl，写完后原子替换，避免半截文件。"""
+    log = get_dagster_logger()
+    out_path = base_path.ensure_dir("langflow_batch", context.partition_key) / "results.jsonl"
+    tmp_path = out_path.with_suffix(".jsonl.tmp")
+
+    total = failed = 0
+    latencies: list[float] = []
+    t0 = time.perf_counter()
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for item in langflow.run_flow_batch(
+            langflow_batch_inputs,
+            flow_id=config.flow_id,
+            concurrency=config.concurrency,
+            rate_limit_per_s=config.rate_limit_per_s,
+            session_id=config.session_id,
+        ):
+            f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+            total += 1
+            failed += item["error"] is not None
+            latencies.append(item["latency_s"])
+    os.replace(tmp_path, out_path)
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    summary = {
+        "partition": context.partition_key,
+        "total": total,
+        "failed": failed,
+        "output_path": str(out_path),
+    }
+    log.info("langflow_batch_run summary=%s elapsed=%.3fs", summary, elapsed)
+    return MaterializeResult(
+        value=summary,
+        metadata={
+            "total": total,
+            "failed": failed,
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+            "latency_p50_s": round(latencies[len(latencies) // 2], 4) if latencies else 0.0,
+            "concurrency": config.concurrency,
+            "output_path": MetadataValue.path(str(out_path)),
         },
     )
 
@@ -128,4 +343,8 @@ __all__ = [
     "qdrant_upsert",
     "qdrant_search",
     "langflow_run_flow",
+    "langflow_batch_inputs",
+    "langflow_batch_run",
+    "LangflowBatchConfig",
+    "QdrantCollectionConfig",
 ]
@@ -1,14 +1,26 @@
 from __future__ import annotations
 
+import hashlib
+import heapq
 import json
+import os
+import re
+import sqlite3
+import threading
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
 from typing import Any
 
-from dagster import ConfigurableResource
-from pydantic import Field
+from dagster import Config, ConfigurableResource, get_dagster_logger
+from pydantic import Field, PrivateAttr
+
+from ..core.resources import BasePathResource
 
 
 class LangflowStubResource(ConfigurableResource):
@@ -99,15 +111,302 @@ class LangflowRestResource(ConfigurableResource):
             body["session_id"] = session_id
         return self._request("POST", path, body)
 
+    def run_flow_batch(
+        self,
+        inputs: Iterable[str],
+        *,
+        flow_id: str | None = None,
+        output_type: str = "chat",
+        input_type: str = "chat",
+        tweaks: dict[str, Any] | None = None,
+        session_id: str | None = None,
+        concurrency: int = 4,
+        rate_limit_per_s: float | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """以有界并发批量调用 run_flow，按完成顺序逐条产出结果（流式，不整体驻留内存）。
+
+        - concurrency: 线程池大小；在途请求不超过 2 * concurrency，可安全消费超大输入迭代器
+        - rate_limit_per_s: 全局请求速率上限（每秒请求数），为空或 <= 0 表示不限速
+        - session_id: 非空时所有请求复用同一 LangFlow 会话（适合共享上下文的批处理）
+
+        每条结果为 {"index", "input", "response", "error", "latency_s"}；单条失败不会中断整批。
+        """
+        limiter = _RateLimiter(rate_limit_per_s)
+        workers = max(1, int(concurrency))
+
+        def _call(index: int, text: str) -> dict[str, Any]:
+            limiter.acquire()
+            t0 = time.perf_counter()
+            item: dict[str, Any] = {"index": index, "input": text, "response": None, "error": None}
+            try:
+                item["response"] = self.run_flow(
+                    flow_id=flow_id,
+                    input_value=text,
+                    output_type=output_type,
+                    input_type=input_type,
+                    tweaks=tweaks,
+                    session_id=session_id,
+                )
+            except Exception as e:  # 容错：记录错误并继续处理其余输入
+                item["error"] = f"{type(e).__name__}: {e}"
+            item["latency_s"] = time.perf_counter() - t0
+            return item
+
+        pending: set[Future] = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="langflow-batch") as pool:
+            for index, text in enumerate(inputs):
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        yield fut.result()
+                pending.add(pool.submit(_call, index, text))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+
+
+class _RateLimiter:
+    """线程安全的最小间隔限速器：保证相邻两次 acquire 至少间隔 1 / rate 秒。"""
+
+    def __init__(self, rate_per_s: float | None) -> None:
+        self._interval = 1.0 / rate_per_s if rate_per_s and rate_per_s > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _normalize_prompt(text: str) -> str:
+    """归一化输入：去首尾空白、合并连续空白并 casefold，使等价 prompt 命中同一缓存键。"""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def _hash_embedding(text: str, dim: int = 256) -> Any:
+    """字符 3-gram 特征哈希向量（L2 归一化），用于近似重复 prompt 的轻量相似度匹配。"""
+    np = _numpy()
+    vec = np.zeros(dim, dtype=np.float32)
+    padded = f"  {text} "
+    for i in range(len(padded) - 2):
+        h = int.from_bytes(
+            hashlib.blake2b(padded[i : i + 3].encode("utf-8"), digest_size=8).digest()
+        )
+        vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def _bump_stat(conn: sqlite3.Connection, name: str, n: int = 1) -> None:
+    """累加 SQLite 缓存的 stats 表计数（CachedLangflowResource / EmbeddingCacheResource 共用）。"""
+    conn.execute(
+        "INSERT INTO stats(name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, n),
+    )
+
+
+class CachedLangflowResource(LangflowRestResource):
+    """带响应缓存的 LangFlow REST 资源：相同/近似输入直接返回缓存，避免重复调用 LLM。
+
+    - 缓存键：flow_id + tweaks + input/output_type（scope）+ 归一化后的 input_value
+    - 近似匹配：similarity_threshold 非空时，在同一 scope 内按字符 n-gram 哈希向量做余弦匹配
+    - 存储：BasePathResource 下 langflow_cache/responses.sqlite（WAL 模式，支持多线程并发读写）
+    - 淘汰：超过 cache_ttl_s 的条目失效；超过 cache_max_entries / cache_max_bytes 时按 LRU 淘汰
+    - 统计：cache_stats() 返回累计命中/未命中与命中率，供资产写入物化元数据
+
+    携带 session_id 或 stream=True 的调用依赖会话上下文，直接透传、不走缓存。
+    """
+
+    base_path: BasePathResource
+    cache_ttl_s: float = Field(default=7 * 24 * 3600, description="缓存有效期（秒）")
+    cache_max_entries: int = Field(default=10_000, description="最大缓存条目数")
+    cache_max_bytes: int = Field(default=256 * 1024 * 1024, description="响应体累计最大字节数")
+    similarity_threshold: float | None = Field(
+        default=None, description="近似匹配的余弦相似度阈值（如 0.95），为空则仅精确匹配"
+    )
+    similarity_scan_limit: int = Field(default=1000, description="近似匹配时扫描的最近条目上限")
+
+    def _db_path(self) -> Path:
+        return self.base_path.ensure_dir("langflow_cache") / "responses.sqlite"
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # 每次操作使用独立连接，保证在线程池中调用 run_flow 时的线程安全
+        conn = sqlite3.connect(self._db_path(), timeout=30)
+        try:
+            with conn:
+                self._init_db(conn)
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _init_db(conn: sqlite3.Connection) -> None:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                embedding BLOB,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_scope ON entries(scope, last_access);
+            CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """
+        )
+
+    def _cache_get(self, key: str, scope: str, norm: str) -> Any:
+        now = time.time()
+        min_created = now - self.cache_ttl_s
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM entries WHERE key = ? AND created_at >= ?",
+                (key, min_created),
+            ).fetchone()
+            hit_key, kind = (key, "hits") if row else (None, None)
+            if row is None and self.similarity_threshold is not None:
+                np = _numpy()
+                rows = conn.execute(
+                    "SELECT key, embedding, response FROM entries "
+                    "WHERE scope = ? AND created_at >= ? ORDER BY last_access DESC LIMIT ?",
+                    (scope, min_created, self.similarity_scan_limit),
+                ).fetchall()
+                if rows:
+                    mat = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32)
+                    sims = mat.reshape(len(rows), -1) @ _hash_embedding(norm)
+                    best = int(sims.argmax())
+                    if float(sims[best]) >= self.similarity_threshold:
+                        hit_key, kind, row = rows[best][0], "semantic_hits", (rows[best][2],)
+            if row is None:
+                _bump_stat(conn, "misses")
+                return None
+            conn.execute(
+                "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, hit_key)
+            )
+            _bump_stat(conn, kind)
+        return json.loads(row[0])
+
+    def _cache_put(self, key: str, scope: str, norm: str, resp: Any) -> None:
+        now = time.time()
+        raw = json.dumps(resp, ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries"
+                "(key, scope, embedding, response, size, created_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, scope, _hash_embedding(norm).tobytes(), raw, len(raw), now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute(
+            "DELETE FROM entries WHERE created_at < ?", (now - self.cache_ttl_s,)
+        ).rowcount
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        victims: list[tuple[str]] = []
+        if count > self.cache_max_entries or total > self.cache_max_bytes:
+            for k, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC"):
+                if count <= self.cache_max_entries and total <= self.cache_max_bytes:
+                    break
+                victims.append((k,))
+                count, total = count - 1, total - size
+            conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        if expired or victims:
+            _bump_stat(conn, "evictions", expired + len(victims))
+
+    def cache_stats(self) -> dict[str, Any]:
+        """返回累计缓存统计：entries/bytes/hits/semantic_hits/misses/evictions/hit_rate。"""
+        with self._connect() as conn:
+            stats = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        out = {
+            "entries": entries,
+            "bytes": size,
+            **{k: int(stats.get(k, 0)) for k in ("hits", "semantic_hits", "misses", "evictions")},
+        }
+        lookups = out["hits"] + out["semantic_hits"] + out["misses"]
+        out["hit_rate"] = (out["hits"] + out["semantic_hits"]) / lookups if lookups else 0.0
+        return out
+
+    def run_flow(
+        self,
+        *,
+        flow_id: str | None = None,
+        input_value: str = "hello",
+        output_type: str = "chat",
+        input_type: str = "chat",
+        tweaks: dict[str, Any] | None = None,
+        session_id: str | None = None,
+        stream: bool = False,
+    ) -> Any:
+        """先查缓存，未命中再调用 LangFlow 并写回缓存（仅缓存成功的 dict 响应）。"""
+        kwargs: dict[str, Any] = {
+            "flow_id": flow_id,
+            "input_value": input_value,
+            "output_type": output_type,
+            "input_type": input_type,
+            "tweaks": tweaks,
+            "session_id": session_id,
+            "stream": stream,
+        }
+        fid = flow_id or self.default_flow_id
+        if not fid or session_id or stream:
+            return super().run_flow(**kwargs)
+
+        scope = hashlib.sha256(
+            json.dumps(
+                {"flow_id": fid, "tweaks": tweaks or {}, "out": output_type, "in": input_type},
+                sort_keys=True,
+                default=str,
+            ).encode("utf-8")
+        ).hexdigest()
+        norm = _normalize_prompt(input_value)
+        key = hashlib.sha256(f"{scope}\0{norm}".encode()).hexdigest()
+
+        cached = self._cache_get(key, scope, norm)
+        if cached is not None:
+            return cached
+        resp = super().run_flow(**kwargs)
+        if isinstance(resp, dict) and resp.get("status") != "skipped":
+            self._cache_put(key, scope, norm, resp)
+        return resp
+
 
 class QdrantHttpResource(ConfigurableResource):
     """极简 Qdrant REST 客户端资源（不依赖第三方库）。
 
     仅覆盖本项目最小需求：
-    - ensure_collection(size, distance): 创建或幂等确保 collection 存在
+    - ensure_collection(size, distance, ...): 创建或幂等确保 collection 存在，并检测配置漂移
     - upsert(points): 写入/更新向量
+    - delete(ids): 按 id 删除 points
     - search(vector, limit, with_payload): 近邻检索
 
+    存储/索引选项（字段为默认值，ensure_collection 的同名参数可覆盖）：
+    - hnsw_m / hnsw_ef_construct: HNSW 图参数
+    - quantization: scalar（int8，约 4x 压缩）| product（x16 压缩）；原始向量用于 rescore
+    - on_disk: 原始向量存放在磁盘（memmap），配合量化常驻内存可显著降低内存
+    - optimizers_config: 透传 Qdrant optimizers_config（如 indexing_threshold）
+    - on_drift: 已存在 collection 的配置与请求不一致时 warn | update（PATCH 可变项）| error
+
     注意：生产中请使用官方 SDK 并启用鉴权/SSL/重试等能力。
     """
 
@@ -119,6 +418,15 @@ class QdrantHttpResource(ConfigurableResource):
     )
     collection: str = Field(default="dagma_demo", description="默认使用的 collection 名称")
     timeout: float = Field(default=5.0, description="HTTP 超时时间（秒）")
+    hnsw_m: int | None = Field(default=None, description="HNSW 每层最大连接数（m）")
+    hnsw_ef_construct: int | None = Field(default=None, description="HNSW 构建期 ef_construct")
+    quantization: str | None = Field(default=None, description="向量量化：scalar | product")
+    quantization_always_ram: bool = Field(default=True, description="量化向量是否常驻内存")
+    on_disk: bool | None = Field(default=None, description="原始向量是否存放在磁盘")
+    optimizers_config: dict[str, int] | None = Field(
+        default=None, description="Qdrant optimizers_config（如 indexing_threshold）"
+    )
+    on_drift: str = Field(default="warn", description="配置漂移处理：warn | update | error")
 
     # ===== 内部基础能力 =====
     def _base_url(self) -> str:
@@ -151,17 +459,139 @@ class QdrantHttpResource(ConfigurableResource):
             raise RuntimeError(f"Qdrant connection error: {e}") from e
 
     # ===== 公开 API =====
-    def ensure_collection(self, size: int, distance: str = "Cosine") -> Any:
-        """确保 collection 存在（幂等）。"""
+    def collection_url(self, suffix: str = "") -> str:
+        """返回 collection 的 REST 地址（可附加子路径，如 /points/search），用于元数据链接。"""
+        return f"{self._base_url()}/collections/{self.collection}{suffix}"
+
+    def collection_config(
+        self,
+        size: int,
+        distance: str = "Cosine",
+        *,
+        hnsw_m: int | None = None,
+        hnsw_ef_construct: int | None = None,
+        quantization: str | None = None,
+        on_disk: bool | None = None,
+        optimizers_config: dict[str, int] | None = None,
+    ) -> dict[str, Any]:
+        """组装创建 collection 的请求体；参数为空时回退到资源字段，未设置的项不下发。"""
+
+        def _pick(value: Any, default: Any) -> Any:
+            return default if value is None else value
+
+        body: dict[str, Any] = {"vectors": {"size": int(size), "distance": distance}}
+        disk = _pick(on_disk, self.on_disk)
+        if disk is not None:
+            body["vectors"]["on_disk"] = disk
+        hnsw = {
+            "m": _pick(hnsw_m, self.hnsw_m),
+            "ef_construct": _pick(hnsw_ef_construct, self.hnsw_ef_construct),
+        }
+        hnsw = {k: v for k, v in hnsw.items() if v is not None}
+        if hnsw:
+            body["hnsw_config"] = hnsw
+        quant = _pick(quantization, self.quantization)
+        always_ram = self.quantization_always_ram
+        if quant == "scalar":
+            body["quantization_config"] = {
+                "scalar": {"type": "int8", "quantile": 0.99, "always_ram": always_ram}
+            }
+        elif quant == "product":
+            body["quantization_config"] = {
+                "product": {"compression": "x16", "always_ram": always_ram}
+            }
+        elif quant is not None:
+            raise ValueError(f"Unsupported quantization: {quant}")
+        optimizers = _pick(optimizers_config, self.optimizers_config)
+        if optimizers:
+            body["optimizers_config"] = dict(optimizers)
+        return body
+
+    @staticmethod
+    def _diff(requested: Any, actual: Any, prefix: str = "") -> dict[str, dict[str, Any]]:
+        """递归比较：仅检查请求中出现的键，返回 {路径: {requested, actual}}。"""
+        if isinstance(requested, dict):
+            actual = actual if isinstance(actual, dict) else {}
+            out: dict[str, dict[str, Any]] = {}
+            for k, v in requested.items():
+                out.update(QdrantHttpResource._diff(v, actual.get(k), f"{prefix}{k}."))
+            return out
+        if requested != actual:
+            return {prefix.rstrip("."): {"requested": requested, "actual": actual}}
+        return {}
+
+    def collection_drift(self, requested: dict[str, Any]) -> dict[str, dict[str, Any]]:
+        """读取现有 collection 配置并与请求体比较，返回漂移项（无漂移时为空）。"""
+        info = self._request("GET", f"/collections/{self.collection}")
+        config = (info or {}).get("result", {}).get("config", {})
+        # 创建请求体与 GET 返回的结构键名不同：vectors 位于 params 下，optimizer 为单数
+        actual = {
+            "vectors": config.get("params", {}).get("vectors"),
+            "hnsw_config": config.get("hnsw_config"),
+            "quantization_config": config.get("quantization_config"),
+            "optimizers_config": config.get("optimizer_config"),
+        }
+        return self._diff(requested, actual)
+
+    def _resolve_drift(self, requested: dict[str, Any], drift: dict[str, Any]) -> None:
+        if self.on_drift == "error":
+            raise RuntimeError(f"Qdrant collection {self.collection} config drift: {drift}")
+        if self.on_drift != "update":
+            get_dagster_logger().warning(
+                "Qdrant collection %s config drift: %s", self.collection, drift
+            )
+            return
+        immutable = [k for k in drift if k in {"vectors.size", "vectors.distance"}]
+        if immutable:
+            raise RuntimeError(
+                f"Qdrant collection {self.collection} immutable drift {immutable}; recreate it"
+            )
+        # 可在线更新的项通过 PATCH 下发（无名向量的参数挂在空字符串键下）
+        patch: dict[str, Any] = {
+            k: requested[k]
+            for k in ("hnsw_config", "quantization_config", "optimizers_config")
+            if any(d.startswith(f"{k}.") for d in drift)
+        }
+        if "vectors.on_disk" in drift:
+            patch["vectors"] = {"": {"on_disk": requested["vectors"]["on_disk"]}}
+        if patch:
+            self._request("PATCH", f"/collections/{self.collection}", patch)
+
+    def ensure_collection(
+        self,
+        size: int,
+        distance: str = "Cosine",
+        *,
+        hnsw_m: int | None = None,
+        hnsw_ef_construct: int | None = None,
+        quantization: str | None = None,
+        on_disk: bool | None = None,
+        optimizers_config: dict[str, int] | None = None,
+    ) -> Any:
+        """确保 collection 存在（幂等）；已存在时检测配置漂移并按 on_drift 处理。
+
+        已存在时返回 {"status": ..., "drift": {路径: {requested, actual}}}。
+        """
         path = f"/collections/{self.collection}"
-        body = {"vectors": {"size": size, "distance": distance}}
+        body = self.collection_config(
+            size,
+            distance,
+            hnsw_m=hnsw_m,
+            hnsw_ef_construct=hnsw_ef_construct,
+            quantization=quantization,
+            on_disk=on_disk,
+            optimizers_config=optimizers_config,
+        )
         try:
             return self._request("PUT", path, body)
         except RuntimeError as e:
             msg = str(e)
             # 已存在时返回 409，应视为幂等成功
             if "409 Conflict" in msg or "already exists" in msg:
-                return {"status": {"message": "collection exists"}}
+                drift = self.collection_drift(body)
+                if drift:
+                    self._resolve_drift(body, drift)
+                return {"status": {"message": "collection exists"}, "drift": drift}
             raise
 
     def upsert(self, points: Iterable[dict[str, Any]]) -> Any:
@@ -205,14 +635,745 @@ class QdrantHttpResource(ConfigurableResource):
         # 4) PUT top-level batch
         return self._request("PUT", base_path, batch)
 
+    def delete(self, ids: Iterable[Any]) -> Any:
+        """按 id 删除 points（不存在的 id 忽略）。"""
+        path = f"/collections/{self.collection}/points/delete?wait=true"
+        return self._request("POST", path, {"points": list(ids)})
+
     def search(
-        self, vector: list[float], limit: int = 3, with_payload: bool = True
+        self,
+        vector: list[float],
+        limit: int = 3,
+        with_payload: bool = True,
+        query_filter: dict[str, Any] | None = None,
+        search_params: dict[str, Any] | None = None,
     ) -> list[dict[str, Any]]:
-        """向集合执行相似度搜索，返回结果列表。"""
+        """向集合执行相似度搜索，返回结果列表。
+
+        query_filter / search_params 为 Qdrant 原生 filter 与 params 结构
+        （如 {"hnsw_ef": 128, "exact": False, "quantization": {"rescore": True}}）。
+        """
         path = f"/collections/{self.collection}/points/search"
-        body = {"vector": vector, "limit": int(limit), "with_payload": with_payload}
+        body: dict[str, Any] = {"vector": vector, "limit": int(limit), "with_payload": with_payload}
+        if query_filter:
+            body["filter"] = query_filter
+        if search_params:
+            body["params"] = search_params
         resp = self._request("POST", path, body)
         return resp.get("result", []) if isinstance(resp, dict) else []
 
 
-__all__ = ["LangflowStubResource", "LangflowRestResource", "QdrantHttpResource"]
+class QdrantShardConfig(Config):
+    """单个分片的位置：主机（可选不同主机）+ collection。"""
+
+    host: str = Field(default="localhost", description="Qdrant 主机名或域名")
+    port: int = Field(default=6333, description="Qdrant 端口")
+    use_https: bool = Field(default=False, description="是否使用 https")
+    api_key: str | None = Field(default=None, description="Qdrant API Key（可选）")
+    collection: str = Field(description="该分片使用的 collection 名称")
+
+
+class ShardedQdrantResource(ConfigurableResource):
+    """跨多个 collection/主机分片的 Qdrant 资源：与 QdrantHttpResource 相同的最小 API。
+
+    - routing=hash:   按 point id 的稳定哈希分配分片
+    - routing=tenant: 按 payload[tenant_key] 的稳定哈希分配分片（同租户落在同一分片），
+      缺少租户字段时回退为 id 哈希；search(tenant=...) 时只查询对应分片
+    - ensure_collection / upsert 在各分片上并行执行；routing=tenant 时 point 的租户变化后，
+      会从其他分片删除同 id 的旧副本
+    - search 并行扇出到所有分片，按 score 合并 top-k（Euclid 距离越小越近，其余越大越近）
+
+    分片布局（数量/顺序）一旦写入数据不应再变更，否则路由结果会改变。
+    """
+
+    shards: list[QdrantShardConfig] = Field(description="分片列表（顺序决定路由结果）")
+    routing: str = Field(default="hash", description="路由方式：hash | tenant")
+    tenant_key: str = Field(default="tenant", description="routing=tenant 时使用的 payload 字段")
+    distance: str = Field(default="Cosine", description="距离类型，决定合并结果时的排序方向")
+    timeout: float = Field(default=5.0, description="HTTP 超时时间（秒）")
+    max_workers: int | None = Field(default=None, description="并行线程数，默认等于分片数")
+
+    def _clients(self) -> list[QdrantHttpResource]:
+        return [
+            QdrantHttpResource(
+                host=sh.host,
+                port=sh.port,
+                use_https=sh.use_https,
+                api_key=sh.api_key,
+                collection=sh.collection,
+                timeout=self.timeout,
+            )
+            for sh in self.shards
+        ]
+
+    def _map(self, fn: Any, items: list[Any]) -> list[Any]:
+        """在线程池中并行执行 fn(item)，保持输入顺序返回结果。"""
+        if len(items) <= 1:
+            return [fn(x) for x in items]
+        workers = self.max_workers or len(items)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qdrant-shard") as pool:
+            return list(pool.map(fn, items))
+
+    @staticmethod
+    def _stable_hash(value: Any) -> int:
+        # 不使用内置 hash()：其对 str 的结果随进程随机化，无法跨进程稳定路由
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def shard_for(self, point: dict[str, Any]) -> int:
+        """返回 point 应写入的分片下标。"""
+        key: Any = point["id"]
+        if self.routing == "tenant":
+            tenant = (point.get("payload") or {}).get(self.tenant_key)
+            if tenant is not None:
+                key = f"tenant:{tenant}"
+        return self._stable_hash(key) % len(self.shards)
+
+    @property
+    def collection(self) -> str:
+        return ",".join(sh.collection for sh in self.shards)
+
+    def collection_url(self, suffix: str = "") -> str:
+        """返回首个分片的 collection 地址（元数据链接用，完整布局见 collection 字段）。"""
+        return self._clients()[0].collection_url(suffix)
+
+    def ensure_collection(self, size: int, distance: str | None = None, **options: Any) -> Any:
+        """在所有分片上并行确保 collection 存在（幂等）；options 透传 HNSW/量化/存储参数。
+
+        distance 缺省取资源的 distance 字段；两者不一致时抛出 ValueError，
+        否则 search 会按错误的方向合并各分片结果。
+        """
+        distance = distance or self.distance
+        if distance != self.distance:
+            raise ValueError(
+                f"distance={distance} 与 ShardedQdrantResource.distance={self.distance} 不一致，"
+                "请在资源配置中设置相同的 distance"
+            )
+        results = self._map(
+            lambda c: c.ensure_collection(size=size, distance=distance, **options), self._clients()
+        )
+        drift = {
+            f"{sh.collection}:{k}": v
+            for sh, r in zip(self.shards, results, strict=True)
+            for k, v in ((r or {}).get("drift") or {}).items()
+        }
+        return {"shards": results, "drift": drift}
+
+    def upsert(self, points: Iterable[dict[str, Any]]) -> Any:
+        """按路由规则分组后，并行写入各分片。"""
+        clients = self._clients()
+        groups: list[list[dict[str, Any]]] = [[] for _ in clients]
+        for p in points:
+            groups[self.shard_for(p)].append(p)
+        work = [(c, g) for c, g in zip(clients, groups, strict=True) if g]
+        results = self._map(lambda cg: cg[0].upsert(cg[1]), work)
+        if self.routing == "tenant":
+            # 租户变化会改变路由：新副本写入后，从其余分片删除同 id 的旧副本
+            ids = [[p["id"] for p in g] for g in groups]
+            stale = [
+                (c, [pid for j, g in enumerate(ids) if j != i for pid in g])
+                for i, c in enumerate(clients)
+            ]
+            self._map(lambda cs: cs[0].delete(cs[1]), [(c, x) for c, x in stale if x])
+        return {
+            "shards": [
+                {"collection": c.collection, "count": len(g), "result": r}
+                for (c, g), r in zip(work, results, strict=True)
+            ]
+        }
+
+    def search(
+        self,
+        vector: list[float],
+        limit: int = 3,
+        with_payload: bool = True,
+        tenant: Any = None,
+    ) -> list[dict[str, Any]]:
+        """扇出检索并按 score 合并 top-k；每条结果附带来源分片下标 shard。
+
+        tenant 非空时附加租户过滤；routing=tenant 时只查询该租户所在分片。
+        """
+        clients = self._clients()
+        query_filter = None
+        if tenant is not None:
+            # 分片内可能混有多个租户，需以 payload 过滤保证只返回该租户的数据
+            query_filter = {"must": [{"key": self.tenant_key, "match": {"value": tenant}}]}
+        if tenant is not None and self.routing == "tenant":
+            idx = self.shard_for({"id": None, "payload": {self.tenant_key: tenant}})
+            targets = [(idx, clients[idx])]
+        else:
+            targets = list(enumerate(clients))
+
+        def _one(target: tuple[int, QdrantHttpResource]) -> list[dict[str, Any]]:
+            i, c = target
+            found = c.search(vector, limit, with_payload, query_filter=query_filter)
+            return [{**hit, "shard": i} for hit in found]
+
+        hits = [h for part in self._map(_one, targets) for h in part]
+        pick = heapq.nsmallest if self.distance == "Euclid" else heapq.nlargest
+        return pick(int(limit), hits, key=lambda h: h.get("score", 0.0))
+
+
+# 懒加载 numpy，避免 import 带来的冷启动成本（与 MlflowTrackingResource._mlflow 一致）
+def _numpy():
+    try:
+        import numpy as np
+    except Exception as e:  # pragma: no cover - 依赖问题属于环境配置错误
+        raise RuntimeError("numpy 未安装，请先在环境中安装（pyproject.toml）。") from e
+    return np
+
+
+class LocalVectorIndexResource(ConfigurableResource):
+    """进程内向量索引资源：与 QdrantHttpResource 相同的最小 API，无需 Qdrant 服务。
+
+    - ensure_collection(size, distance) / upsert(points) / search(vector, limit, with_payload)
+    - 数据持久化到 BasePathResource 下的 vector_index/<collection>/：
+      meta.json（维度/距离/版本）、vectors.f32（内存映射的 float32 矩阵）、
+      ids.json 与 payloads.json（与向量行对齐）、以及可选的 IVF/HNSW 索引文件。
+    - index_type:
+      - flat: NumPy 暴力检索（默认，结果精确）
+      - ivf:  k-means 粗聚类 + nprobe 个簇内暴力检索；点数少于 ivf_min_points 时退化为 flat
+      - hnsw: 依赖可选的 hnswlib（未安装时给出清晰报错）
+
+    适用于本地开发、CI 与小规模 collection（网络往返比检索本身更慢的场景）。
+    Cosine 距离在写入时归一化，score 语义与 Qdrant 保持一致（Euclid 返回距离，越小越近）。
+    """
+
+    base_path: BasePathResource
+    collection: str = Field(default="dagma_demo", description="默认使用的 collection 名称")
+    index_type: str = Field(default="flat", description="索引类型：flat | ivf | hnsw")
+    ivf_nlist: int = Field(default=16, description="IVF 聚类中心数量")
+    ivf_nprobe: int = Field(default=4, description="IVF 检索时探测的簇数量")
+    ivf_min_points: int = Field(default=1024, description="点数达到该阈值后才构建 IVF")
+    hnsw_m: int = Field(default=16, description="HNSW 每层最大连接数")
+    hnsw_ef_construct: int = Field(default=100, description="HNSW 构建期候选队列大小")
+    hnsw_ef: int = Field(default=64, description="HNSW 检索期候选队列大小")
+
+    # 进程内缓存：按 meta.json 中的 version 失效，避免每次检索重复解析 ids/payloads
+    _cache: dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    # ===== 内部基础能力 =====
+    def _dir(self) -> Path:
+        return self.base_path.ensure_dir("vector_index", self.collection)
+
+    def _read_meta(self) -> dict[str, Any]:
+        p = self._dir() / "meta.json"
+        if not p.exists():
+            raise RuntimeError(
+                f"Local collection not found: {self.collection}. Call ensure_collection() first."
+            )
+        return json.loads(p.read_text(encoding="utf-8"))
+
+    def _write_json(self, name: str, obj: Any) -> None:
+        # 先写临时文件再原子替换，避免中断时留下半截文件
+        p = self._dir() / name
+        tmp = p.with_suffix(p.suffix + ".tmp")
+        tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, p)
+
+    def _load(self) -> dict[str, Any]:
+        meta = self._read_meta()
+        cached = self._cache.get(self.collection)
+        if cached is not None and cached["meta"]["version"] == meta["version"]:
+            return cached
+        np = _numpy()
+        d = self._dir()
+        count, size = int(meta["count"]), int(meta["size"])
+        vectors = (
+            np.memmap(d / "vectors.f32", dtype=np.float32, mode="r", shape=(count, size))
+            if count
+            else np.zeros((0, size), dtype=np.float32)
+        )
+        # ids/payloads 先于 meta.json 写入：中断后可能多出未提交的尾部，以 meta 的 count 为准
+        ids = json.loads((d / "ids.json").read_text(encoding="utf-8"))[:count] if count else []
+        payloads = (
+            json.loads((d / "payloads.json").read_text(encoding="utf-8"))[:count] if count else []
+        )
+        state = {"meta": meta, "vectors": vectors, "ids": ids, "payloads": payloads}
+        if meta.get("ivf"):
+            state["ivf_centroids"] = np.load(d / "ivf_centroids.npy")
+            state["ivf_assign"] = np.load(d / "ivf_assign.npy")
+        self._cache[self.collection] = state
+        return state
+
+    def _prepare(self, vectors: Any, distance: str) -> Any:
+        np = _numpy()
+        arr = np.asarray(vectors, dtype=np.float32)
+        if distance == "Cosine":
+            norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+            arr = arr / np.where(norms == 0, 1.0, norms)
+        return arr
+
+    @staticmethod
+    def _scores(mat: Any, q: Any, distance: str) -> Any:
+        np = _numpy()
+        if distance == "Euclid":
+            return np.linalg.norm(mat - q, axis=1)
+        return mat @ q
+
+    def _build_ivf(self, vectors: Any) -> tuple[Any, Any]:
+        """最小 k-means（固定迭代次数），返回 (centroids, assign)。"""
+        np = _numpy()
+        nlist = max(1, min(self.ivf_nlist, len(vectors)))
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+        assign = np.zeros(len(vectors), dtype=np.int32)
+        for _ in range(10):
+            d2 = (
+                (vectors**2).sum(axis=1, keepdims=True)
+                - 2 * vectors @ centroids.T
+                + (centroids**2).sum(axis=1)
+            )
+            assign = d2.argmin(axis=1).astype(np.int32)
+            for c in range(nlist):
+                members = vectors[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        return centroids.astype(np.float32), assign
+
+    @staticmethod
+    def _hnswlib():
+        try:
+            import hnswlib
+        except Exception as e:  # pragma: no cover - 可选依赖
+            raise RuntimeError("index_type=hnsw 需要安装可选依赖 hnswlib。") from e
+        return hnswlib
+
+    def _hnsw_space(self, distance: str) -> str:
+        return {"Cosine": "cosine", "Dot": "ip", "Euclid": "l2"}[distance]
+
+    def _hnsw_path(self, meta: dict[str, Any]) -> Path:
+        # 文件名带 collection 版本：index_type 切换或中途写入后不会误用过期的索引
+        return self._dir() / f"hnsw-{int(meta['version'])}.bin"
+
+    def _build_hnsw(self, vectors: Any, meta: dict[str, Any]) -> None:
+        hnswlib = self._hnswlib()
+        # collection 级参数（ensure_collection 时写入 meta）优先于资源字段
+        hnsw = meta.get("hnsw_config") or {}
+        index = hnswlib.Index(space=self._hnsw_space(meta["distance"]), dim=vectors.shape[1])
+        index.init_index(
+            max_elements=max(1, len(vectors)),
+            ef_construction=hnsw.get("ef_construct", self.hnsw_ef_construct),
+            M=hnsw.get("m", self.hnsw_m),
+        )
+        index.add_items(vectors, list(range(len(vectors))))
+        path = self._hnsw_path(meta)
+        tmp = path.with_suffix(".bin.tmp")
+        index.save_index(str(tmp))
+        os.replace(tmp, path)
+        for old in self._dir().glob("hnsw*.bin"):
+            if old != path:
+                old.unlink(missing_ok=True)
+
+    def _search_hnsw(self, state: dict[str, Any], q: Any, limit: int) -> tuple[Any, Any]:
+        np = _numpy()
+        hnswlib = self._hnswlib()
+        meta = state["meta"]
+        index = state.get("hnsw")
+        if index is None:
+            path = self._hnsw_path(meta)
+            if not path.exists():
+                # 上次写入时 index_type 不是 hnsw（或构建被中断）：按当前向量惰性重建
+                self._build_hnsw(np.asarray(state["vectors"]), meta)
+            index = hnswlib.Index(space=self._hnsw_space(meta["distance"]), dim=int(meta["size"]))
+            index.load_index(str(path), max_elements=int(meta["count"]))
+            index.set_ef(max(self.hnsw_ef, limit))
+            state["hnsw"] = index
+        labels, dists = index.knn_query(q, k=min(limit, int(meta["count"])))
+        rows, d = labels[0].astype(np.int64), dists[0]
+        # hnswlib 返回距离：cosine/ip 为 1 - 相似度，l2 为平方距离
+        scores = np.sqrt(d) if meta["distance"] == "Euclid" else 1.0 - d
+        return rows, scores
+
+    # ===== 公开 API（与 QdrantHttpResource 对齐） =====
+    def collection_url(self, suffix: str = "") -> str:
+        """返回本地 collection 目录的 file:// 地址（可附加子路径，与 Qdrant 资源签名对齐）。"""
+        return self._dir().resolve().as_uri() + suffix
+
+    def ensure_collection(
+        self,
+        size: int,
+        distance: str = "Cosine",
+        *,
+        hnsw_m: int | None = None,
+        hnsw_ef_construct: int | None = None,
+        **_storage_options: Any,
+    ) -> Any:
+        """确保本地 collection 存在（幂等）；维度或距离不一致时报错。
+
+        hnsw_m / hnsw_ef_construct 记录到 meta 并用于 index_type=hnsw 的构建，已存在时返回漂移项；
+        quantization / on_disk / optimizers_config 仅对 Qdrant 有意义（本地向量本就以 memmap
+        存放在磁盘），此处接受并忽略，以便资产代码可在两种后端间无缝切换。
+        """
+        if distance not in {"Cosine", "Dot", "Euclid"}:
+            raise ValueError(f"Unsupported distance: {distance}")
+        hnsw = {"m": hnsw_m, "ef_construct": hnsw_ef_construct}
+        hnsw = {k: v for k, v in hnsw.items() if v is not None}
+        p = self._dir() / "meta.json"
+        if p.exists():
+            meta = json.loads(p.read_text(encoding="utf-8"))
+            if int(meta["size"]) != int(size) or meta["distance"] != distance:
+                raise RuntimeError(
+                    f"Local collection {self.collection} exists with "
+                    f"size={meta['size']} distance={meta['distance']}"
+                )
+            current = meta.get("hnsw_config") or {}
+            drift = {
+                f"hnsw_config.{k}": {"requested": v, "actual": current.get(k)}
+                for k, v in hnsw.items()
+                if current.get(k) != v
+            }
+            return {"status": {"message": "collection exists"}, "drift": drift}
+        meta = {"size": int(size), "distance": distance, "count": 0, "version": 0}
+        if hnsw:
+            meta["hnsw_config"] = hnsw
+        self._write_json("meta.json", meta)
+        return {"result": True, "status": "ok"}
+
+    def upsert(self, points: Iterable[dict[str, Any]]) -> Any:
+        """写入/更新 points（包含 id, vector, payload）；同 id 覆盖原行，新 id 追加到末尾。"""
+        np = _numpy()
+        # 同一批内重复的 id 以最后一条为准（与 Qdrant 语义一致）
+        pts = list({p["id"]: p for p in points}.values())
+        state = self._load()
+        meta = dict(state["meta"])
+        size, distance = int(meta["size"]), meta["distance"]
+        ids = list(state["ids"])
+        payloads = list(state["payloads"])
+        row_of = {pid: i for i, pid in enumerate(ids)}
+
+        new_vecs = self._prepare([p["vector"] for p in pts], distance).reshape(-1, size)
+        updates: list[tuple[int, int]] = []
+        appends: list[int] = []
+        for j, p in enumerate(pts):
+            row = row_of.get(p["id"])
+            if row is None:
+                row_of[p["id"]] = len(ids)
+                ids.append(p["id"])
+                payloads.append(p.get("payload"))
+                appends.append(j)
+            else:
+                payloads[row] = p.get("payload")
+                updates.append((row, j))
+
+        path = self._dir() / "vectors.f32"
+        if updates:
+            mm = np.memmap(path, dtype=np.float32, mode="r+", shape=(int(meta["count"]), size))
+            for row, j in updates:
+                mm[row] = new_vecs[j]
+            mm.flush()
+            del mm
+        if appends:
+            with open(path, "ab") as f:
+                # 先截断到已提交的行数：上次写入若在替换 meta.json 前中断，丢弃其残留的尾部行
+                f.truncate(int(meta["count"]) * size * 4)
+                f.write(new_vecs[appends].tobytes())
+
+        meta["count"] = len(ids)
+        meta["version"] = int(meta["version"]) + 1
+        meta["ivf"] = False
+        self._write_json("ids.json", ids)
+        self._write_json("payloads.json", payloads)
+
+        # 依据 index_type 重建辅助索引（小规模 collection 下重建成本可接受）
+        if meta["count"]:
+            all_vecs = np.memmap(path, dtype=np.float32, mode="r", shape=(meta["count"], size))
+            if self.index_type == "ivf" and meta["count"] >= self.ivf_min_points:
+                centroids, assign = self._build_ivf(np.asarray(all_vecs))
+                np.save(self._dir() / "ivf_centroids.npy", centroids)
+                np.save(self._dir() / "ivf_assign.npy", assign)
+                meta["ivf"] = True
+            elif self.index_type == "hnsw":
+                self._build_hnsw(np.asarray(all_vecs), meta)
+        self._write_json("meta.json", meta)
+        self._cache.pop(self.collection, None)
+        return {"result": {"operation_id": meta["version"], "status": "completed"}, "status": "ok"}
+
+    def search(
+        self, vector: list[float], limit: int = 3, with_payload: bool = True
+    ) -> list[dict[str, Any]]:
+        """相似度检索，返回与 Qdrant 相同结构的结果列表：[{id, score, payload?}]。"""
+        np = _numpy()
+        state = self._load()
+        meta = state["meta"]
+        count, distance = int(meta["count"]), meta["distance"]
+        if not count or limit <= 0:
+            return []
+        q = self._prepare(vector, distance).reshape(-1)
+        vectors = state["vectors"]
+
+        if self.index_type == "hnsw":
+            rows, scores = self._search_hnsw(state, q.reshape(1, -1), limit)
+        else:
+            if meta.get("ivf"):
+                centroid_scores = self._scores(state["ivf_centroids"], q, distance)
+                nprobe = min(self.ivf_nprobe, len(centroid_scores))
+                order = np.argsort(centroid_scores)
+                probes = order[:nprobe] if distance == "Euclid" else order[::-1][:nprobe]
+                candidates = np.flatnonzero(np.isin(state["ivf_assign"], probes))
+            else:
+                candidates = np.arange(count)
+            cand_scores = self._scores(np.asarray(vectors[candidates]), q, distance)
+            k = min(limit, len(candidates))
+            keyed = cand_scores if distance == "Euclid" else -cand_scores
+            top = np.argpartition(keyed, k - 1)[:k] if k < len(keyed) else np.arange(len(keyed))
+            top = top[np.argsort(keyed[top], kind="stable")]
+            rows, scores = candidates[top], cand_scores[top]
+
+        results: list[dict[str, Any]] = []
+        for row, score in zip(rows.tolist(), scores.tolist(), strict=False):
+            item: dict[str, Any] = {"id": state["ids"][row], "score": float(score)}
+            if with_payload:
+                item["payload"] = state["payloads"][row]
+            results.append(item)
+        return results
+
+
+class EmbeddingCacheResource(ConfigurableResource):
+    """跨运行的嵌入缓存：按 (model_id, 文本哈希) 复用已计算的向量，仅对未命中的文本分批计算。
+
+    - 存储：BasePathResource 下 embedding_cache/<model_id>-<短哈希>/：
+      vectors.f32（内存映射的 float32 矩阵，每条文本一行）+ index.sqlite（文本哈希 -> 行号）
+    - 淘汰：向量总字节数超过 max_bytes 时按 LRU 淘汰，空出的行号供后续写入复用，文件不会无限增长
+    - 统计：stats(model_id) 返回累计命中/未命中/淘汰与命中率
+
+    返回的向量统一经 float32 往返，命中与重新计算的结果逐位一致，数据版本不随缓存状态变化。
+    """
+
+    base_path: BasePathResource
+    max_bytes: int = Field(default=512 * 1024 * 1024, description="向量文件最大字节数（LRU 淘汰）")
+    batch_size: int = Field(default=64, description="未命中文本每批计算的条数")
+
+    # ===== 内部基础能力 =====
+    def _dir(self, model_id: str) -> Path:
+        # 目录名附带原始 model_id 的短哈希：清洗后同名的模型（如 m/1 与 m_1）不会共享缓存
+        digest = hashlib.blake2b(model_id.encode("utf-8"), digest_size=4).hexdigest()
+        safe = re.sub(r"[^\w.-]+", "_", model_id)
+        return self.base_path.ensure_dir("embedding_cache", f"{safe}-{digest}")
+
+    @staticmethod
+    def _text_key(text: str) -> str:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    @contextmanager
+    def _connect(self, model_id: str) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._dir(model_id) / "index.sqlite", timeout=30)
+        try:
+            with conn:
+                self._init_db(conn)
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _init_db(conn: sqlite3.Connection) -> None:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access);
+            CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """
+        )
+
+    @staticmethod
+    def _meta(conn: sqlite3.Connection) -> dict[str, int]:
+        return dict(conn.execute("SELECT name, value FROM meta").fetchall())
+
+    @staticmethod
+    def _lookup(conn: sqlite3.Connection, keys: list[str]) -> dict[str, int]:
+        rows: dict[str, int] = {}
+        for i in range(0, len(keys), 500):  # 分块，避免超过 SQLite 参数个数上限
+            chunk = keys[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows.update(conn.execute(f"SELECT key, row FROM entries WHERE key IN ({marks})", chunk))
+        return rows
+
+    def _evict(self, conn: sqlite3.Connection, keep: int) -> int:
+        """按 last_access 淘汰至最多 keep 条，被淘汰的行号进入空闲表。"""
+        (count,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count <= keep:
+            return 0
+        victims = conn.execute(
+            "SELECT key, row FROM entries ORDER BY last_access ASC, row ASC LIMIT ?",
+            (count - keep,),
+        ).fetchall()
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+        conn.executemany(
+            "INSERT OR IGNORE INTO free_rows(row) VALUES (?)", [(r,) for _, r in victims]
+        )
+        return len(victims)
+
+    def _store(self, model_id: str, vectors: dict[str, Any], misses: int = 0) -> int:
+        """写入新向量：优先复用空闲行，不足时在文件末尾扩容；返回本次淘汰条数。
+
+        misses 为调用方尚未计入统计的未命中数，在同一写事务内累加。
+        """
+        np = _numpy()
+        now = time.time()
+        with self._connect(model_id) as conn:
+            # 写事务串行化：行号分配与文件扩容在并发运行间保持一致
+            conn.execute("BEGIN IMMEDIATE")
+            if misses:
+                _bump_stat(conn, "misses", misses)
+            meta = self._meta(conn)
+            dim = int(next(iter(vectors.values())).shape[0])
+            if meta.setdefault("dim", dim) != dim:
+                raise RuntimeError(
+                    f"Embedding dim mismatch for model {model_id}: "
+                    f"cache has {meta['dim']}, got {dim}"
+                )
+            # 并发运行可能已写入同一文本
+            existing = self._lookup(conn, list(vectors))
+            todo = {k: v for k, v in vectors.items() if k not in existing}
+            if not todo:
+                return 0
+            max_rows = max(1, self.max_bytes // (dim * 4))
+            evicted = self._evict(conn, max(0, max_rows - len(todo)))
+            free = [
+                r
+                for (r,) in conn.execute(
+                    "SELECT row FROM free_rows ORDER BY row LIMIT ?", (len(todo),)
+                )
+            ]
+            conn.executemany("DELETE FROM free_rows WHERE row = ?", [(r,) for r in free])
+            if free:
+                # 复用行会覆盖其原有向量：递增 epoch，供读取方校验无锁读到的数据
+                meta["epoch"] = int(meta.get("epoch", 0)) + 1
+            total = int(meta.get("rows", 0))
+            rows = free + list(range(total, total + len(todo) - len(free)))
+            total += len(todo) - len(free)
+
+            path = self._dir(model_id) / "vectors.f32"
+            with open(path, "ab") as f:
+                f.truncate(total * dim * 4)
+            mm = np.memmap(path, dtype=np.float32, mode="r+", shape=(total, dim))
+            mm[rows] = np.stack(list(todo.values()))
+            mm.flush()
+            del mm
+
+            conn.executemany(
+                "INSERT INTO entries(key, row, last_access) VALUES (?, ?, ?)",
+                [(k, r, now) for k, r in zip(todo, rows, strict=True)],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta(name, value) VALUES (?, ?)",
+                [("dim", dim), ("rows", total), ("epoch", int(meta.get("epoch", 0)))],
+            )
+            evicted += self._evict(conn, max_rows)
+            if evicted:
+                _bump_stat(conn, "evictions", evicted)
+        return evicted
+
+    def _read_rows(
+        self, model_id: str, meta: dict[str, int], rows: dict[str, int]
+    ) -> dict[str, Any]:
+        np = _numpy()
+        if not rows:
+            return {}
+        mm = np.memmap(
+            self._dir(model_id) / "vectors.f32",
+            dtype=np.float32,
+            mode="r",
+            shape=(int(meta["rows"]), int(meta["dim"])),
+        )
+        found = {k: np.array(mm[r]) for k, r in rows.items()}
+        del mm
+        return found
+
+    # ===== 对外 API =====
+    def get_or_embed(
+        self,
+        texts: list[str],
+        embed_fn: Any,
+        *,
+        model_id: str,
+        batch_size: int | None = None,
+    ) -> tuple[Any, dict[str, int]]:
+        """返回 (float32 矩阵 [len(texts), dim], 本次统计 {hits, misses, evictions})。
+
+        embed_fn(list[str]) -> 向量列表，仅对未命中的文本按 batch_size 分批调用；
+        同一批内的重复文本只计算一次，统计按去重后的文本计。
+        """
+        np = _numpy()
+        keys = [self._text_key(t) for t in texts]
+        unique = dict(zip(keys, texts, strict=True))
+        with self._connect(model_id) as conn:
+            # 查找与读取在只读事务（WAL 快照）中进行，不占用写锁，与写入方互不阻塞
+            conn.execute("BEGIN")
+            meta = self._meta(conn)
+            rows = self._lookup(conn, list(unique)) if meta.get("rows") else {}
+            conn.commit()
+            found: dict[str, Any] = self._read_rows(model_id, meta, rows)
+            counted = bool(rows)
+            if counted:
+                # 短写事务：校验 epoch 后更新 LRU 与统计。期间若有写入方复用过空闲行，
+                # 无锁读到的向量可能已属于其他文本，此时持锁重新查找并读取（少见路径）
+                conn.execute("BEGIN IMMEDIATE")
+                current = self._meta(conn)
+                if current.get("epoch", 0) != meta.get("epoch", 0):
+                    meta = current
+                    rows = self._lookup(conn, list(unique))
+                    found = self._read_rows(model_id, meta, rows)
+                conn.executemany(
+                    "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                    [(time.time(), k) for k in rows],
+                )
+                _bump_stat(conn, "hits", len(found))
+                _bump_stat(conn, "misses", len(unique) - len(found))
+
+        misses = [k for k in unique if k not in found]
+        step = max(1, batch_size or self.batch_size)
+        for i in range(0, len(misses), step):
+            chunk = misses[i : i + step]
+            vecs = np.asarray(embed_fn([unique[k] for k in chunk]), dtype=np.float32)
+            found.update(zip(chunk, vecs, strict=True))
+        # 全部未命中时读路径不写库，未命中计数随 _store 的写事务一并提交
+        evicted = (
+            self._store(
+                model_id, {k: found[k] for k in misses}, misses=0 if counted else len(misses)
+            )
+            if misses
+            else 0
+        )
+
+        if keys:
+            out = np.stack([found[k] for k in keys])
+        else:
+            out = np.zeros((0, int(meta.get("dim", 0))), dtype=np.float32)
+        return out, {"hits": len(unique) - len(misses), "misses": len(misses), "evictions": evicted}
+
+    def stats(self, model_id: str) -> dict[str, Any]:
+        """返回累计统计：entries/bytes/hits/misses/evictions/hit_rate。"""
+        with self._connect(model_id) as conn:
+            stats = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            (entries,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            meta = self._meta(conn)
+        out = {
+            "entries": entries,
+            "bytes": int(meta.get("rows", 0)) * int(meta.get("dim", 0)) * 4,
+            **{k: int(stats.get(k, 0)) for k in ("hits", "misses", "evictions")},
+        }
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+
+__all__ = [
+    "LangflowStubResource",
+    "LangflowRestResource",
+    "CachedLangflowResource",
+    "QdrantHttpResource",
+    "QdrantShardConfig",
+    "ShardedQdrantResource",
+    "LocalVectorIndexResource",
+    "EmbeddingCacheResource",
+]
@@ -1,3 +1,3 @@
 """模型相关模块（M1：提供最小 MLflow stub 资源与资产）。"""
 
-__all__ = ["assets", "resources"]
+__all__ = ["assets", "resources", "sensors"]
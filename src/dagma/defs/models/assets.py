@@ -7,11 +7,17 @@ from typing import Any
 
 from dagster import MaterializeResult, MetadataValue, ResourceParam, asset, get_dagster_logger
 
+from ..core.automation import on_inputs_changed
+from ..core.profiling import profiled
+
 
 @asset(
     group_name="models",
+    code_version="1",
+    automation_condition=on_inputs_changed(),
     description="最小训练占位：记录参数、指标与 artifact 至 MLflow 资源（stub 或 tracking）。",
 )
+@profiled
 def train_model_stub(mlflow: ResourceParam[Any]) -> MaterializeResult[dict]:
     log = get_dagster_logger()
     run_id = mlflow.start_run()
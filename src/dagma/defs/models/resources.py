@@ -1,10 +1,46 @@
 from __future__ import annotations
 
+import atexit
+import fcntl
+import json
 import os
-from typing import Any
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, ClassVar
 
-from dagster import ConfigurableResource
-from pydantic import Field
+from dagster import ConfigurableResource, get_dagster_logger
+from pydantic import Field, PrivateAttr
+
+from ..core.resources import BasePathResource
+
+
+class _StubRun:
+    """Stub run 记录：参数为 dict，指标按名称保存为紧凑的 array('d') 序列。"""
+
+    __slots__ = ("run_id", "params", "metrics", "active")
+
+    def __init__(self, run_id: str) -> None:
+        self.run_id = run_id
+        self.params: dict[str, Any] = {}
+        self.metrics: dict[str, array] = {}
+        self.active = True
+
+    def as_dict(self) -> dict:
+        # 兼容旧结构：metrics 仅暴露每个指标的最新值
+        return {
+            "run_id": self.run_id,
+            "params": self.params,
+            "metrics": {k: v[-1] for k, v in self.metrics.items()},
+            "active": self.active,
+        }
 
 
 class MlflowStubResource(ConfigurableResource):
@@ -12,40 +48,160 @@ class MlflowStubResource(ConfigurableResource):
 
     - start_run(): 返回一个伪 run_id，并将 run 置为活跃。
     - log_param(name, value): 记录参数到当前活跃 run。
-    - log_metric(name, value): 记录指标到当前活跃 run。
+    - log_metric(name, value): 追加指标到当前活跃 run 的序列。
     - close_run(run_id): 关闭对应 run。
+    - get_metric_history(run_id, name): 返回指标的完整序列。
+
+    内部按 run_id 建索引并维护活跃 run 栈，每次 log_* 为 O(1)；
+    max_runs 限制内存中的 run 数量（按关闭顺序淘汰已关闭的 run，O(1)）；
+    sqlite_path 非空时，run 在创建时登记编号、关闭时写入参数与指标，淘汰后仍可查询。
 
     仅用于 M1 演示资源注入与测试。不要在生产中使用。
     """
 
     tracking_uri: str | None = None
-    runs: list[dict] = Field(default_factory=list)
+    max_runs: int | None = Field(default=None, description="内存中保留的最大 run 数（可选）")
+    sqlite_path: str | None = Field(default=None, description="持久化 SQLite 文件路径（可选）")
 
-    def start_run(self) -> str:
-        run_id = f"run-{len(self.runs) + 1}"
-        self.runs.append({"run_id": run_id, "params": {}, "metrics": {}, "active": True})
+    _runs: OrderedDict[str, _StubRun] = PrivateAttr(default_factory=OrderedDict)
+    _active: list[_StubRun] = PrivateAttr(default_factory=list)
+    # 已关闭 run 按关闭顺序排列，淘汰时从队首弹出，无需扫描 _runs
+    _closed: OrderedDict[str, None] = PrivateAttr(default_factory=OrderedDict)
+    _counter: int = PrivateAttr(default=0)
+
+    @property
+    def runs(self) -> list[dict]:
+        """内存中 run 的只读视图（按创建顺序），兼容旧的 list[dict] 访问方式。"""
+        return [r.as_dict() for r in self._runs.values()]
+
+    def _connect(self) -> sqlite3.Connection:
+        Path(self.sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.sqlite_path)
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, active INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS params (
+                run_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT, PRIMARY KEY (run_id, key)
+            );
+            CREATE TABLE IF NOT EXISTS metrics (
+                run_id TEXT NOT NULL, key TEXT NOT NULL, step INTEGER NOT NULL, value REAL NOT NULL,
+                PRIMARY KEY (run_id, key, step)
+            );
+            """
+        )
+        return conn
+
+    def _next_run_id(self) -> str:
+        if not self.sqlite_path:
+            self._counter += 1
+            return f"run-{self._counter}"
+        # 在 start_run 时即登记 run：同一写事务内取已登记编号的最大值，
+        # 活跃/崩溃未关闭的 run 以及共享同一文件的其他实例都不会拿到重复的 run_id
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            (last,) = conn.execute(
+                "SELECT MAX(CAST(substr(run_id, 5) AS INTEGER)) FROM runs WHERE run_id LIKE 'run-%'"
+            ).fetchone()
+            self._counter = max(self._counter, last or 0) + 1
+            run_id = f"run-{self._counter}"
+            # 不用 OR REPLACE：编号冲突应直接报错，而不是覆盖其他 run 的记录
+            conn.execute("INSERT INTO runs(run_id, active) VALUES (?, 1)", (run_id,))
+            conn.commit()
+        finally:
+            conn.close()
         return run_id
 
-    def _get_active_run(self) -> dict:
-        for r in reversed(self.runs):
-            if r.get("active"):
-                return r
-        raise RuntimeError("No active run. Call start_run() first.")
+    def _persist(self, r: _StubRun) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE runs SET active = ? WHERE run_id = ?", (int(r.active), r.run_id)
+                )
+                # 重复关闭时整体重写本 run 的参数与指标
+                conn.execute("DELETE FROM params WHERE run_id = ?", (r.run_id,))
+                conn.execute("DELETE FROM metrics WHERE run_id = ?", (r.run_id,))
+                conn.executemany(
+                    "INSERT INTO params(run_id, key, value) VALUES (?, ?, ?)",
+                    [(r.run_id, k, json.dumps(v, default=str)) for k, v in r.params.items()],
+                )
+                conn.executemany(
+                    "INSERT INTO metrics(run_id, key, step, value) VALUES (?, ?, ?, ?)",
+                    [
+                        (r.run_id, k, step, v)
+                        for k, series in r.metrics.items()
+                        for step, v in enumerate(series)
+                    ],
+                )
+        finally:
+            conn.close()
+
+    def _evict(self) -> None:
+        if self.max_runs is None:
+            return
+        excess = len(self._runs) - self.max_runs
+        if excess <= 0:
+            return
+        for _ in range(min(excess, len(self._closed))):
+            rid, _ = self._closed.popitem(last=False)
+            del self._runs[rid]
+
+    def start_run(self) -> str:
+        run = _StubRun(self._next_run_id())
+        self._runs[run.run_id] = run
+        self._active.append(run)
+        self._evict()
+        return run.run_id
+
+    def _get_active_run(self) -> _StubRun:
+        if not self._active:
+            raise RuntimeError("No active run. Call start_run() first.")
+        return self._active[-1]
 
     def log_param(self, name: str, value: Any) -> None:
         r = self._get_active_run()
-        r["params"][name] = value
+        r.params[name] = value
 
     def log_metric(self, name: str, value: float) -> None:
         r = self._get_active_run()
-        r["metrics"][name] = float(value)
+        series = r.metrics.get(name)
+        if series is None:
+            series = r.metrics[name] = array("d")
+        series.append(float(value))
 
     def close_run(self, run_id: str) -> None:
-        for r in self.runs:
-            if r.get("run_id") == run_id:
-                r["active"] = False
-                return
-        raise KeyError(f"Run not found: {run_id}")
+        r = self._runs.get(run_id)
+        if r is None:
+            raise KeyError(f"Run not found: {run_id}")
+        if r.active:
+            r.active = False
+            # 通常关闭的是栈顶 run；嵌套/乱序关闭时才线性移除
+            if self._active and self._active[-1] is r:
+                self._active.pop()
+            else:
+                self._active.remove(r)
+            self._closed[run_id] = None
+        if self.sqlite_path:
+            self._persist(r)
+        self._evict()
+
+    def get_metric_history(self, run_id: str, name: str) -> list[float]:
+        """返回指定 run 的指标序列；内存中已淘汰时回退到 SQLite 查询。"""
+        r = self._runs.get(run_id)
+        if r is not None:
+            return list(r.metrics.get(name, ()))
+        if not self.sqlite_path:
+            raise KeyError(f"Run not found: {run_id}")
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT value FROM metrics WHERE run_id = ? AND key = ? ORDER BY step",
+                (run_id, name),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [v for (v,) in rows]
 
 
 class MlflowTrackingResource(ConfigurableResource):
@@ -124,4 +280,275 @@ class MlflowTrackingResource(ConfigurableResource):
             self._active_run_id = None
 
 
-__all__ = ["MlflowStubResource", "MlflowTrackingResource"]
+# 后台同步线程为守护线程：进程退出时最多等待各自的 sync_exit_timeout_s，
+# 未完成的部分已记录在 .progress 中，由下次 sync_pending() 续传
+_background_syncs: list[tuple[threading.Thread, float]] = []
+
+
+def _join_background_syncs() -> None:
+    start = time.monotonic()
+    for t, timeout in _background_syncs:
+        t.join(max(0.0, start + timeout - time.monotonic()))
+
+
+atexit.register(_join_background_syncs)
+
+
+class MlflowLocalFirstResource(ConfigurableResource):
+    """本地优先的 MLflow 追踪资源：训练期只写本地追加日志，关闭 run 后再批量同步到远端。
+
+    - 与 MlflowStubResource / MlflowTrackingResource 保持相同的最小 API
+      （start_run/log_param/log_metric/log_artifact/close_run），资产代码无需修改。
+    - 每个 run 写入 BasePathResource 下 mlflow_local/runs/<run_id>.jsonl（只追加），
+      每 fsync_every 条记录 fsync 一次，关闭 run 时强制落盘；
+      artifact 复制到 mlflow_local/artifacts/<run_id>/。
+    - close_run 后在后台守护线程中通过 MlflowClient.log_batch 批量回放到 remote_tracking_uri，
+      进程退出时最多等待 sync_exit_timeout_s；成功后写入 <run_id>.synced 标记，
+      失败或超时时 <run_id>.progress 记录远端 run 与已写入的批次，下次 sync_pending() 从断点续传。
+    - <run_id>.lock 上的 flock 在写入期间由写入进程持有，同步时由回放方持有：
+      跨进程不会重复回放同一 run；锁可获取但缺少 end 记录的 run 视为写入进程已崩溃，
+      补写 FAILED 结束记录后照常同步（定期调用见 models.sensors.mlflow_local_sync_sensor）。
+
+    训练吞吐不再受追踪服务延迟/可用性影响，且无需网络即可测试。
+    """
+
+    base_path: BasePathResource
+    remote_tracking_uri: str | None = Field(
+        default_factory=lambda: os.getenv("MLFLOW_TRACKING_URI", "http://mlflow:5000"),
+        description="同步目标 MLflow Tracking URI；为空则只写本地",
+    )
+    experiment_name: str = Field(default_factory=lambda: os.getenv("MLFLOW_EXPERIMENT", "Default"))
+    fsync_every: int = Field(default=64, description="每写入多少条记录执行一次 fsync")
+    sync_async: bool = Field(default=True, description="close_run 后是否在后台线程中同步")
+    sync_exit_timeout_s: float = Field(
+        default=10.0, description="进程退出时等待后台同步的最长时间（秒），其余留待下次续传"
+    )
+
+    _active_run_id: str | None = PrivateAttr(default=None)
+    _fh: Any = PrivateAttr(default=None)
+    _lock_fh: Any = PrivateAttr(default=None)
+    _unsynced_writes: int = PrivateAttr(default=0)
+    _step: dict[str, int] = PrivateAttr(default_factory=dict)
+    _sync_threads: list[threading.Thread] = PrivateAttr(default_factory=list)
+
+    # MLflow log_batch 单次上限：参数 100 条，参数 + 指标合计 1000 条
+    _MAX_PARAMS_PER_BATCH: ClassVar[int] = 100
+    _MAX_ENTITIES_PER_BATCH: ClassVar[int] = 1000
+
+    @staticmethod
+    def _mlflow():
+        return MlflowTrackingResource._mlflow()
+
+    def _runs_dir(self) -> Path:
+        return self.base_path.ensure_dir("mlflow_local", "runs")
+
+    @staticmethod
+    @contextmanager
+    def _claim(path: Path) -> Iterator[bool]:
+        """非阻塞获取 run 的跨进程锁；已被写入方或其他回放方持有时产出 False。"""
+        with open(path.with_suffix(".lock"), "a") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _append(self, record: dict[str, Any], *, sync: bool = False) -> None:
+        if self._fh is None:
+            raise RuntimeError("No active run. Call start_run() first.")
+        self._fh.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._unsynced_writes += 1
+        if sync or self._unsynced_writes >= self.fsync_every:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._unsynced_writes = 0
+
+    def start_run(self) -> str:
+        if self._active_run_id:
+            raise RuntimeError(f"Run already active: {self._active_run_id}")
+        run_id = uuid.uuid4().hex
+        path = self._runs_dir() / f"{run_id}.jsonl"
+        # 写入期间持有锁（进程崩溃时由内核释放），回放方据此区分进行中与已中断的 run
+        self._lock_fh = open(path.with_suffix(".lock"), "a")
+        fcntl.flock(self._lock_fh, fcntl.LOCK_EX)
+        self._fh = open(path, "a", encoding="utf-8")
+        self._active_run_id = run_id
+        self._step = {}
+        self._append(
+            {"t": "start", "experiment": self.experiment_name, "ts": int(time.time() * 1000)},
+            sync=True,
+        )
+        return run_id
+
+    def _require_active(self) -> str:
+        if not self._active_run_id:
+            raise RuntimeError("No active run. Call start_run() first.")
+        return self._active_run_id
+
+    def log_param(self, name: str, value: Any) -> None:
+        self._require_active()
+        self._append({"t": "param", "k": name, "v": str(value)})
+
+    def log_metric(self, name: str, value: float) -> None:
+        self._require_active()
+        step = self._step.get(name, 0)
+        self._step[name] = step + 1
+        self._append(
+            {
+                "t": "metric",
+                "k": name,
+                "v": float(value),
+                "ts": int(time.time() * 1000),
+                "step": step,
+            }
+        )
+
+    def log_artifact(self, local_path: str, artifact_path: str | None = None) -> None:
+        """复制文件到本地 artifact 目录，待同步时再上传。"""
+        run_id = self._require_active()
+        dest_dir = self.base_path.ensure_dir("mlflow_local", "artifacts", run_id)
+        dest = dest_dir / f"{len(list(dest_dir.iterdir()))}_{Path(local_path).name}"
+        shutil.copy2(local_path, dest)
+        self._append({"t": "artifact", "path": str(dest), "artifact_path": artifact_path})
+
+    def close_run(self, run_id: str | None = None, status: str = "FINISHED") -> None:
+        rid = run_id or self._require_active()
+        if rid != self._active_run_id:
+            raise KeyError(f"Run not active: {rid}")
+        self._append({"t": "end", "status": status, "ts": int(time.time() * 1000)}, sync=True)
+        self._fh.close()
+        self._fh = None
+        self._lock_fh.close()  # 关闭文件即释放 flock
+        self._lock_fh = None
+        self._active_run_id = None
+        if not self.remote_tracking_uri:
+            return
+        if self.sync_async:
+            # 守护线程：run 结束不等待追踪服务，进程退出时仅有界等待（见 _join_background_syncs）
+            t = threading.Thread(
+                target=self.sync_pending, name=f"mlflow-sync-{rid[:8]}", daemon=True
+            )
+            t.start()
+            self._sync_threads.append(t)
+            _background_syncs[:] = [x for x in _background_syncs if x[0].is_alive()]
+            _background_syncs.append((t, self.sync_exit_timeout_s))
+        else:
+            self.sync_pending()
+
+    def wait_for_sync(self, timeout: float | None = None) -> None:
+        """等待已发起的后台同步完成（主要用于测试与优雅退出）。"""
+        for t in self._sync_threads:
+            t.join(timeout)
+        self._sync_threads = [t for t in self._sync_threads if t.is_alive()]
+
+    def sync_pending(self) -> dict[str, str]:
+        """将所有已结束但未同步的本地 run 批量回放到远端，返回 {local_run_id: remote_run_id}。
+
+        写入中或正被其他进程回放的 run 跳过；写入进程崩溃（无 end 记录）的 run 以 FAILED 结束。
+        """
+        synced: dict[str, str] = {}
+        for path in sorted(self._runs_dir().glob("*.jsonl")):
+            marker = path.with_suffix(".synced")
+            if marker.exists():
+                continue
+            with self._claim(path) as claimed:
+                # 取得锁后再检查标记：其他进程可能刚完成同步
+                if not claimed or marker.exists():
+                    continue
+                records = self._read_records(path)
+                if not records:
+                    continue
+                try:
+                    remote_id = self._replay(path, records)
+                except Exception as e:  # 容错：远端不可用时保留本地数据与进度，下次从断点续传
+                    get_dagster_logger().warning("mlflow sync failed for %s: %s", path.stem, e)
+                    continue
+                marker.write_text(remote_id, encoding="utf-8")
+                path.with_suffix(".progress").unlink(missing_ok=True)
+                synced[path.stem] = remote_id
+        return synced
+
+    @staticmethod
+    def _read_records(path: Path) -> list[dict[str, Any]]:
+        """读取本地日志；调用方须持有该 run 的锁。缺少 end 记录时补写 FAILED 结束记录。"""
+        text = path.read_text(encoding="utf-8")
+        records = []
+        for line in text.splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:  # 崩溃时写了一半的行
+                continue
+        if not records or records[0]["t"] != "start":
+            return []
+        if records[-1]["t"] != "end":
+            end = {"t": "end", "status": "FAILED", "ts": int(path.stat().st_mtime * 1000)}
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(("" if text.endswith("\n") else "\n") + json.dumps(end) + "\n")
+            records.append(end)
+        return records
+
+    @staticmethod
+    def _save_progress(path: Path, progress: dict[str, Any]) -> None:
+        tmp = path.with_suffix(".progress.tmp")
+        tmp.write_text(json.dumps(progress), encoding="utf-8")
+        os.replace(tmp, path.with_suffix(".progress"))
+
+    def _sync_progress(self, client: Any, path: Path, start: dict[str, Any]) -> dict[str, Any]:
+        """返回同步进度；远端 run 只创建一次（重试时复用进度文件或按 local_run_id 标签查找）。"""
+        progress_path = path.with_suffix(".progress")
+        if progress_path.exists():
+            return json.loads(progress_path.read_text(encoding="utf-8"))
+        local_run_id = path.stem
+        exp = client.get_experiment_by_name(start["experiment"])
+        exp_id = exp.experiment_id if exp else client.create_experiment(start["experiment"])
+        # 进度文件写入前中断（已 create_run 但尚未记录）：按标签找回，此时尚未写入任何数据
+        found = client.search_runs(
+            [exp_id], filter_string=f"tags.`dagma.local_run_id` = '{local_run_id}'", max_results=1
+        )
+        if found:
+            remote_id = found[0].info.run_id
+        else:
+            run = client.create_run(
+                exp_id, start_time=start["ts"], tags={"dagma.local_run_id": local_run_id}
+            )
+            remote_id = run.info.run_id
+        progress = {"remote_id": remote_id, "params": 0, "metrics": 0, "artifacts": 0}
+        self._save_progress(path, progress)
+        return progress
+
+    def _replay(self, path: Path, records: list[dict[str, Any]]) -> str:
+        """幂等回放：每批写入成功后记录进度，失败重试时跳过已写入的部分，不会重复建 run。"""
+        mlflow = self._mlflow()
+        Metric, Param = mlflow.entities.Metric, mlflow.entities.Param
+        client = mlflow.tracking.MlflowClient(tracking_uri=self.remote_tracking_uri)
+        start, end = records[0], records[-1]
+        progress = self._sync_progress(client, path, start)
+        remote_id = progress["remote_id"]
+
+        params = [Param(r["k"], r["v"]) for r in records if r["t"] == "param"]
+        metrics = [
+            Metric(r["k"], r["v"], r["ts"], r["step"]) for r in records if r["t"] == "metric"
+        ]
+        artifacts = [r for r in records if r["t"] == "artifact"]
+        for i in range(progress["params"], len(params), self._MAX_PARAMS_PER_BATCH):
+            client.log_batch(remote_id, params=params[i : i + self._MAX_PARAMS_PER_BATCH])
+            progress["params"] = min(len(params), i + self._MAX_PARAMS_PER_BATCH)
+            self._save_progress(path, progress)
+        for i in range(progress["metrics"], len(metrics), self._MAX_ENTITIES_PER_BATCH):
+            client.log_batch(remote_id, metrics=metrics[i : i + self._MAX_ENTITIES_PER_BATCH])
+            progress["metrics"] = min(len(metrics), i + self._MAX_ENTITIES_PER_BATCH)
+            self._save_progress(path, progress)
+        for i in range(progress["artifacts"], len(artifacts)):
+            r = artifacts[i]
+            client.log_artifact(remote_id, r["path"], artifact_path=r["artifact_path"])
+            progress["artifacts"] = i + 1
+            self._save_progress(path, progress)
+        client.set_terminated(remote_id, status=end["status"], end_time=end["ts"])
+        return remote_id
+
+
+__all__ = ["MlflowStubResource", "MlflowTrackingResource", "MlflowLocalFirstResource"]
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import Any
+
+from dagster import DefaultSensorStatus, ResourceParam, SensorEvaluationContext, SkipReason, sensor
+
+
+@sensor(
+    minimum_interval_seconds=300,
+    default_status=DefaultSensorStatus.RUNNING,
+    description="定期回放 MlflowLocalFirstResource 中未同步的本地 run（含崩溃中断的 run）。",
+)
+def mlflow_local_sync_sensor(
+    context: SensorEvaluationContext, mlflow: ResourceParam[Any]
+) -> SkipReason:
+    # 仅做同步，不发起运行；close_run 之外的补偿路径，避免无后续运行时本地 run 长期不同步
+    synced = mlflow.sync_pending()
+    return SkipReason(f"synced {len(synced)} local MLflow run(s)")
+
+
+__all__ = ["mlflow_local_sync_sensor"]
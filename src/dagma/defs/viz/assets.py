@@ -1,11 +1,21 @@
 from __future__ import annotations
 
-from dagster import asset
+from dagster import MaterializeResult, asset
 
+from ..core.automation import content_data_version, on_inputs_changed
+from ..core.profiling import profiled
 
-@asset(group_name="viz", description="将上游汇总数据包装为可视化可消费的结构。")
-def viz_ready_data(sum_numbers: int) -> dict:
-    return {"sum": sum_numbers, "title": "Numbers Summary"}
+
+@asset(
+    group_name="viz",
+    code_version="1",
+    automation_condition=on_inputs_changed(),
+    description="将上游汇总数据包装为可视化可消费的结构。",
+)
+@profiled
+def viz_ready_data(sum_numbers: int) -> MaterializeResult[dict]:
+    data = {"sum": sum_numbers, "title": "Numbers Summary"}
+    return MaterializeResult(value=data, data_version=content_data_version(data))
 
 
 __all__ = ["viz_ready_data"]
@@ -0,0 +1,406 @@
+"""预热工作进程池与对应的 RunLauncher：短作业复用已导入代码位置的进程执行。
+
+默认 DefaultRunLauncher 为每次运行启动全新 Python 进程，需重新导入 dagster/mlflow 与
+dagma.definitions；对大量短时 RAG/LangFlow 作业，启动开销往往大于作业本身。
+
+- WarmWorkerPool（在 user_code 容器内运行）：父进程预先导入代码位置后 fork 出 N 个工作进程，
+  各进程在共享的监听套接字上 accept 运行请求（JSON 行 {"run_id": ...}），确认后在进程内执行；
+  每次运行后还原 os.environ 并结束遗留的 mlflow 活动 run；运行失败、执行满 max_runs_per_worker 次
+  或 RSS 超过 max_rss_mb 后退出（先有界等待后台线程）并由父进程补位，避免状态泄漏与内存蠕变。
+- WarmWorkerRunLauncher（在 daemon/webserver 的 dagster.yaml 中配置）：将 job_names 中的作业
+  派发给进程池；进程池不可达或全部繁忙（连接超时）时回退到 DefaultRunLauncher，
+  不可达后 unavailable_backoff_s 内直接回退，不再逐次等待连接超时。
+  job_names 中的作业应使用 in_process_executor，否则各步骤仍会新建进程。
+
+启动：python -m dagma.warm_worker --port 4100 --workers 2
+（容器内由 docker/user_code_entrypoint.sh 在 DAGMA_WARM_WORKERS > 0 时启动）
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from collections.abc import Callable, Mapping, Sequence
+from typing import Any
+
+from dagster import DagsterRunStatus, DefaultRunLauncher
+from dagster._core.launcher.base import LaunchRunContext, RunLauncher
+from dagster._serdes import ConfigurableClass
+from dagster._serdes.config_class import ConfigurableClassData
+
+WARM_WORKER_TAG = "dagma/warm_worker"
+
+log = logging.getLogger("dagma.warm_worker")
+
+
+def rss_mb() -> float:
+    """当前进程常驻内存（MB）；无 /proc 时退化为峰值 RSS。"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def recycle_reason(
+    runs_done: int, rss: float, max_runs_per_worker: int, max_rss_mb: float
+) -> str | None:
+    """工作进程是否应退出重建：返回原因，无需回收时返回 None（<= 0 的上限表示不限制）。"""
+    if max_runs_per_worker > 0 and runs_done >= max_runs_per_worker:
+        return f"reached max_runs_per_worker={max_runs_per_worker}"
+    if max_rss_mb > 0 and rss > max_rss_mb:
+        return f"rss {rss:.0f}MB > max_rss_mb={max_rss_mb:.0f}"
+    return None
+
+
+def execute_run_in_process(run_id: str) -> bool:
+    """在当前进程执行已创建的运行，与 `dagster api execute_run` 的执行体一致；返回运行是否成功。
+
+    执行体抛出异常时（如实例或代码位置加载失败，运行尚未开始），将未结束的运行标记为失败，
+    避免其停留在 STARTING 状态。
+    """
+    try:
+        from dagster._cli.api import _execute_run_command_body
+
+        instance = _worker_instance()
+        _execute_run_command_body(
+            run_id, instance, write_stream_fn=lambda _event: None, set_exit_code_on_failure=False
+        )
+    except Exception as e:
+        _report_run_failed(run_id, e)
+        raise
+    run = instance.get_run_by_id(run_id)
+    return run is not None and run.status == DagsterRunStatus.SUCCESS
+
+
+def _report_run_failed(run_id: str, error: Exception) -> None:
+    try:
+        instance = _worker_instance()
+        run = instance.get_run_by_id(run_id)
+        if run is not None and not run.is_finished:
+            instance.report_run_failed(
+                run, message=f"Warm worker {os.getpid()} failed to execute run: {error!r}"
+            )
+    except Exception:  # 实例本身不可用时只能记录日志
+        log.exception("warm worker %s: could not mark run %s as failed", os.getpid(), run_id)
+
+
+def _end_mlflow_runs() -> None:
+    """结束运行遗留在 mlflow 全局活动 run 栈中的 run（仅当运行中导入过 mlflow）。"""
+    mlflow = sys.modules.get("mlflow")
+    if mlflow is None:
+        return
+    try:
+        while mlflow.active_run() is not None:
+            mlflow.end_run(status="KILLED")
+    except Exception:
+        log.exception("warm worker %s: could not end leftover mlflow runs", os.getpid())
+
+
+_instance: Any = None
+
+
+def _worker_instance() -> Any:
+    # 实例（含数据库连接）在 fork 之后按进程创建，并在该进程的多次运行间复用
+    global _instance
+    if _instance is None:
+        from dagster import DagsterInstance
+
+        _instance = DagsterInstance.get()
+    return _instance
+
+
+class WarmWorkerPool:
+    """预 fork 工作进程池：父进程只负责预热与补位，运行在子进程中执行。"""
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 4100,
+        workers: int = 2,
+        max_runs_per_worker: int = 50,
+        max_rss_mb: float = 1024.0,
+        preload: Sequence[str] = ("dagma.definitions",),
+        execute: Callable[[str], bool | None] = execute_run_in_process,
+        exit_grace_s: float = 30.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_runs_per_worker = max_runs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.preload = tuple(preload)
+        self.execute = execute
+        self.exit_grace_s = exit_grace_s
+        self._children: set[int] = set()
+        self._stopping = False
+
+    def preload_modules(self) -> None:
+        """在 fork 前导入代码位置并构建仓库定义，子进程通过写时复制共享这些页。"""
+        for name in self.preload:
+            module = importlib.import_module(name)
+            defs = getattr(module, "defs", None)
+            if defs is not None and hasattr(defs, "get_repository_def"):
+                defs.get_repository_def()
+
+    def _spawn(self, sock: socket.socket) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # 子进程不继承兄弟进程列表，避免收到信号时误杀兄弟进程
+            self._children.clear()
+            code = 0
+            try:
+                self._worker_loop(sock)
+            except BaseException:  # 子进程不可把异常抛回父进程的调用栈
+                log.exception("warm worker %s crashed", os.getpid())
+                code = 1
+            finally:
+                self._join_threads()
+                os._exit(code)
+        self._children.add(pid)
+
+    def _join_threads(self) -> None:
+        """os._exit 不等待其他线程：退出前有界等待仍在运行的线程（如 MLflow 后台同步）。"""
+        deadline = time.monotonic() + self.exit_grace_s
+        for t in threading.enumerate():
+            if t is not threading.current_thread():
+                t.join(max(0.0, deadline - time.monotonic()))
+
+    def _execute_isolated(self, run_id: str) -> bool:
+        """执行一次运行并还原进程级状态，返回是否成功。"""
+        env = dict(os.environ)
+        try:
+            return self.execute(run_id) is not False
+        except Exception:  # 运行已被标记为失败（见 execute_run_in_process）
+            log.exception("warm worker %s: run %s failed", os.getpid(), run_id)
+            return False
+        finally:
+            # 执行体会把运行的环境变量注入 os.environ，不能泄漏到本进程的后续运行
+            os.environ.clear()
+            os.environ.update(env)
+            _end_mlflow_runs()
+
+    def _worker_loop(self, sock: socket.socket) -> None:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        sock.settimeout(1.0)  # 定期醒来检查停止标记
+        runs = 0
+        while not stop.is_set():
+            try:
+                conn, _ = sock.accept()
+            except (TimeoutError, InterruptedError):
+                continue
+            with conn:
+                conn.settimeout(10.0)
+                try:
+                    reader = conn.makefile("r", encoding="utf-8")
+                    run_id = str(json.loads(reader.readline())["run_id"])
+                    ack = {"ok": True, "pid": os.getpid(), "runs": runs + 1}
+                    conn.sendall((json.dumps(ack) + "\n").encode("utf-8"))
+                    # 两步握手：launcher 等待超时后已回退并断开时这里读到 EOF，避免重复执行
+                    if reader.readline().strip() != "go":
+                        log.warning("warm worker %s: run %s not confirmed", os.getpid(), run_id)
+                        continue
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    log.warning("warm worker %s: bad request: %s", os.getpid(), e)
+                    continue
+                runs += 1
+            # 确认后断开连接再执行，launcher 无需等待运行结束
+            if not self._execute_isolated(run_id):
+                # 失败的运行可能留下无法还原的进程状态（模块全局变量、线程等），直接重建进程
+                log.info("warm worker %s retiring after failed run %s", os.getpid(), run_id)
+                return
+            reason = recycle_reason(runs, rss_mb(), self.max_runs_per_worker, self.max_rss_mb)
+            if reason:
+                log.info("warm worker %s recycling after %d runs: %s", os.getpid(), runs, reason)
+                return
+
+    def _on_term(self, *_: Any) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve_forever(self) -> None:
+        self.preload_modules()
+        sock = socket.create_server((self.host, self.port), backlog=64)
+        signal.signal(signal.SIGTERM, self._on_term)
+        signal.signal(signal.SIGINT, self._on_term)
+        log.info("warm worker pool listening on %s:%s", self.host, self.port)
+        for _ in range(self.workers):
+            self._spawn(sock)
+        while self._children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            self._children.discard(pid)
+            if not self._stopping:
+                self._spawn(sock)
+        sock.close()
+
+
+class WarmWorkerRunLauncher(RunLauncher, ConfigurableClass):
+    """将短作业派发到 user_code 容器内的预热进程池，其余作业交给 DefaultRunLauncher。"""
+
+    def __init__(
+        self,
+        host: str = "user_code",
+        port: int = 4100,
+        connect_timeout: float = 2.0,
+        job_names: Sequence[str] | None = None,
+        unavailable_backoff_s: float = 30.0,
+        inst_data: ConfigurableClassData | None = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.unavailable_backoff_s = unavailable_backoff_s
+        # 进程池不可达后的退避截止时间（monotonic），期间直接回退
+        self._unavailable_until = 0.0
+        # 为空表示所有作业都尝试走预热进程池
+        self.job_names = set(job_names or [])
+        self._inst_data = inst_data
+        self._fallback: DefaultRunLauncher | None = None
+        super().__init__()
+
+    @property
+    def inst_data(self) -> ConfigurableClassData | None:
+        return self._inst_data
+
+    @classmethod
+    def config_type(cls) -> dict[str, Any]:
+        from dagster import Field, Noneable
+
+        return {
+            "host": Field(str, is_required=False, default_value="user_code"),
+            "port": Field(int, is_required=False, default_value=4100),
+            "connect_timeout": Field(float, is_required=False, default_value=2.0),
+            "job_names": Field(Noneable([str]), is_required=False, default_value=None),
+            "unavailable_backoff_s": Field(float, is_required=False, default_value=30.0),
+        }
+
+    @classmethod
+    def from_config_value(
+        cls, inst_data: ConfigurableClassData, config_value: Mapping[str, Any]
+    ) -> WarmWorkerRunLauncher:
+        return cls(inst_data=inst_data, **config_value)
+
+    @property
+    def fallback(self) -> DefaultRunLauncher:
+        if self._fallback is None:
+            self._fallback = DefaultRunLauncher()
+            self._fallback.register_instance(self._instance)
+        return self._fallback
+
+    def dispatch(self, run_id: str) -> dict[str, Any]:
+        """发送运行请求，收到工作进程确认后回复 go 交由其执行。
+
+        全部工作进程繁忙时请求停留在监听队列中无人确认，connect_timeout 后抛出 TimeoutError。
+        """
+        with socket.create_connection((self.host, self.port), timeout=self.connect_timeout) as s:
+            s.sendall((json.dumps({"run_id": run_id}) + "\n").encode("utf-8"))
+            ack = json.loads(s.makefile("r", encoding="utf-8").readline() or "{}")
+            if not ack.get("ok"):
+                raise ConnectionError(f"warm worker rejected run {run_id}: {ack}")
+            s.sendall(b"go\n")
+        return ack
+
+    def launch_run(self, context: LaunchRunContext) -> None:
+        run = context.dagster_run
+        if not self.job_names or run.job_name in self.job_names:
+            if time.monotonic() < self._unavailable_until:
+                self._instance.report_engine_event(
+                    "Warm worker pool recently unavailable; falling back to DefaultRunLauncher.",
+                    run,
+                    cls=self.__class__,
+                )
+                self.fallback.launch_run(context)
+                return
+            try:
+                ack = self.dispatch(run.run_id)
+            except (OSError, ValueError) as e:
+                self._unavailable_until = time.monotonic() + self.unavailable_backoff_s
+                self._instance.report_engine_event(
+                    f"Warm worker pool unavailable ({e}); falling back to DefaultRunLauncher.",
+                    run,
+                    cls=self.__class__,
+                )
+            else:
+                self._instance.add_run_tags(
+                    run.run_id, {WARM_WORKER_TAG: f"{self.host}:{self.port}/pid={ack['pid']}"}
+                )
+                self._instance.report_engine_event(
+                    f"Launched in warm worker pid {ack['pid']} (run #{ack['runs']} in worker).",
+                    run,
+                    cls=self.__class__,
+                )
+                return
+        self.fallback.launch_run(context)
+
+    def terminate(self, run_id: str) -> bool:
+        run = self._instance.get_run_by_id(run_id)
+        if not run or run.is_finished:
+            return False
+        if WARM_WORKER_TAG not in run.tags:
+            return self.fallback.terminate(run_id)
+        # 进程内执行体的取消线程轮询到 CANCELING 后中断运行
+        self._instance.report_run_canceling(run)
+        return True
+
+    def dispose(self) -> None:
+        if self._fallback is not None:
+            self._fallback.dispose()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Dagma warm worker pool")
+    ap.add_argument("--host", default=os.getenv("DAGMA_WARM_WORKER_HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("DAGMA_WARM_WORKER_PORT", "4100")))
+    ap.add_argument("--workers", type=int, default=int(os.getenv("DAGMA_WARM_WORKERS", "2")))
+    ap.add_argument(
+        "--max-runs-per-worker",
+        type=int,
+        default=int(os.getenv("DAGMA_WARM_WORKER_MAX_RUNS", "50")),
+    )
+    ap.add_argument(
+        "--max-rss-mb",
+        type=float,
+        default=float(os.getenv("DAGMA_WARM_WORKER_MAX_RSS_MB", "1024")),
+    )
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    WarmWorkerPool(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_runs_per_worker=args.max_runs_per_worker,
+        max_rss_mb=args.max_rss_mb,
+    ).serve_forever()
+
+
+__all__ = [
+    "WARM_WORKER_TAG",
+    "WarmWorkerPool",
+    "WarmWorkerRunLauncher",
+    "execute_run_in_process",
+    "recycle_reason",
+]
+
+
+if __name__ == "__main__":
+    main()
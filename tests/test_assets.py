@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import pathlib
+import pickle
 import sys
 
 # 确保 src 在测试导入路径中（避免依赖可编辑安装）
@@ -57,3 +58,182 @@ def test_llm_assets_defined():
     assert callable(llm_assets.embed_texts_stub)
     assert callable(llm_assets.qdrant_upsert)
     assert callable(llm_assets.qdrant_search)
+
+
+def test_llm_rag_chain_with_local_vector_index(tmp_path):
+    from dagma.defs.core.resources import BasePathResource
+    from dagma.defs.llm.resources import EmbeddingCacheResource, LocalVectorIndexResource
+
+    base_path = BasePathResource(base_path=str(tmp_path))
+    resources = {
+        "llm": LocalVectorIndexResource(base_path=base_path),
+        "embedding_cache": EmbeddingCacheResource(base_path=base_path),
+    }
+    assets = [llm_assets.embed_texts_stub, llm_assets.qdrant_upsert, llm_assets.qdrant_search]
+    result = materialize(assets, resources=resources)
+    assert result.success
+    hits = result.output_for_node("qdrant_search")
+    assert len(hits) == 3
+    # 用第一条向量检索，最近邻应为其自身
+    assert hits[0]["payload"]["text"] == "hello world"
+
+    # 检索只经 IO manager 加载查询向量（qdrant_upsert 仅为顺序依赖），字节数应显著小于整份嵌入
+    loaded_inputs = {
+        name
+        for name, spec in llm_assets.qdrant_search.op.ins.items()
+        if not spec.dagster_type.is_nothing
+    }
+    assert loaded_inputs == {"embed_query_vector"}
+    query = result.output_for_node("embed_texts_stub", "embed_query_vector")
+    embeddings = result.output_for_node("embed_texts_stub", "embed_texts_stub")
+    assert len(pickle.dumps(query)) * 3 < len(pickle.dumps(embeddings))
+
+    # 再次物化：嵌入全部命中缓存，向量与数据版本保持不变
+    again = materialize(assets, resources=resources)
+    md = {
+        ev.asset_key.path[-1]: ev.event_specific_data.materialization
+        for ev in again.get_asset_materialization_events()
+    }
+    assert md["embed_texts_stub"].metadata["embedding_cache_misses"].value == 0
+    assert md["embed_texts_stub"].metadata["embedding_cache_hit_rate"].value == 1.0
+    assert again.output_for_node("embed_texts_stub", "embed_texts_stub") == result.output_for_node(
+        "embed_texts_stub", "embed_texts_stub"
+    )
+
+
+def test_embed_multi_asset_subset(tmp_path):
+    from dagma.defs.core.resources import BasePathResource
+    from dagma.defs.llm.resources import EmbeddingCacheResource
+
+    cache = EmbeddingCacheResource(base_path=BasePathResource(base_path=str(tmp_path)))
+    result = materialize(
+        [llm_assets.embed_texts_stub],
+        selection=["embed_query_vector"],
+        resources={"embedding_cache": cache},
+    )
+    assert result.success
+    keys = {ev.asset_key.path[-1] for ev in result.get_asset_materialization_events()}
+    assert keys == {"embed_query_vector"}
+    assert len(result.output_for_node("embed_texts_stub", "embed_query_vector")) == 8
+    # 仅查询向量被选中时只嵌入一条文本
+    assert cache.stats("stub-ord-8")["entries"] == 1
+
+
+def test_langflow_batch_run_streams_partitioned_output(tmp_path, monkeypatch):
+    import json
+
+    from dagma.defs.core.resources import BasePathResource
+    from dagma.defs.llm.resources import LangflowRestResource
+
+    def fake_request(self, method, path, body=None):
+        if body["input_value"] == "boom":
+            raise RuntimeError("LangFlow HTTP 500")
+        return {"echo": body["input_value"], "session_id": body.get("session_id")}
+
+    monkeypatch.setattr(LangflowRestResource, "_request", fake_request)
+    base = BasePathResource(base_path=str(tmp_path))
+    base.ensure_dir("langflow").joinpath("batch_inputs.txt").write_text(
+        "a\nb\n\nboom\nc\n", encoding="utf-8"
+    )
+    result = materialize(
+        [llm_assets.langflow_batch_inputs, llm_assets.langflow_batch_run],
+        resources={
+            "base_path": base,
+            "langflow": LangflowRestResource(default_flow_id="flow-1"),
+        },
+        partition_key="2025-01-02",
+        run_config={
+            "ops": {"langflow_batch_run": {"config": {"concurrency": 2, "session_id": "s1"}}}
+        },
+    )
+    assert result.success
+    summary = result.output_for_node("langflow_batch_run")
+    assert (summary["total"], summary["failed"]) == (4, 1)
+
+    lines = (tmp_path / "langflow_batch" / "2025-01-02" / "results.jsonl").read_text()
+    rows = sorted((json.loads(x) for x in lines.splitlines()), key=lambda r: r["index"])
+    assert [r["input"] for r in rows] == ["a", "b", "boom", "c"]
+    assert rows[0]["response"]["session_id"] == "s1"
+    assert rows[2]["error"].startswith("RuntimeError")
+
+
+def test_automation_skips_noop_rematerialization():
+    from dagster import (
+        AssetKey,
+        DagsterInstance,
+        MaterializeResult,
+        asset,
+        evaluate_automation_conditions,
+    )
+
+    from dagma.defs.core.automation import content_data_version
+    from dagma.defs.viz import assets as viz_assets
+
+    chain = [data_assets.raw_numbers, data_assets.sum_numbers, viz_assets.viz_ready_data]
+    instance = DagsterInstance.ephemeral()
+    assert materialize(chain, instance=instance).success
+
+    result = evaluate_automation_conditions(defs=chain, instance=instance)
+    assert result.total_requested == 0
+
+    # 上游以相同内容重物化：数据版本不变，下游不应被触发
+    assert materialize([data_assets.raw_numbers], instance=instance).success
+    result = evaluate_automation_conditions(defs=chain, instance=instance, cursor=result.cursor)
+    assert result.total_requested == 0
+
+    # 上游内容变化：仅直接下游 sum_numbers 被触发
+    @asset(name="raw_numbers", group_name="data", code_version="1")
+    def raw_numbers_changed():
+        return MaterializeResult(
+            value=[1, 2, 3, 4], data_version=content_data_version([1, 2, 3, 4])
+        )
+
+    assert materialize([raw_numbers_changed], instance=instance).success
+    result = evaluate_automation_conditions(defs=chain, instance=instance, cursor=result.cursor)
+    assert result.get_requested_partitions(AssetKey("sum_numbers")) == {None}
+    assert result.total_requested == 1
+
+
+def test_automation_sensor_stopped_unless_opted_in(monkeypatch):
+    import importlib
+
+    from dagster import DefaultSensorStatus
+
+    import dagma.definitions
+
+    monkeypatch.delenv("DAGMA_AUTOMATION", raising=False)
+    mod = importlib.reload(dagma.definitions)
+    assert mod.dagma_automation_sensor.default_status == DefaultSensorStatus.STOPPED
+    monkeypatch.setenv("DAGMA_AUTOMATION", "true")
+    mod = importlib.reload(dagma.definitions)
+    assert mod.dagma_automation_sensor.default_status == DefaultSensorStatus.RUNNING
+    monkeypatch.delenv("DAGMA_AUTOMATION")
+    importlib.reload(dagma.definitions)
+
+
+def test_profiling_hook_opt_in(tmp_path, monkeypatch):
+    from dagma.defs.core.profiling import PROFILE_ENV, PROFILE_TAG
+
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    # 未声明 base_path 资源的资产回退到默认根目录（相对当前工作目录）
+    monkeypatch.chdir(tmp_path)
+    assets = [data_assets.raw_numbers, data_assets.sum_numbers]
+
+    # 默认关闭：不产生剖析元数据与文件
+    result = materialize(assets)
+    for ev in result.get_asset_materialization_events():
+        assert "profile_folded" not in ev.materialization.metadata
+    assert not (tmp_path / ".dagma_data" / "profiles").exists()
+
+    # 运行标签开启：每个资产附带 folded 文件路径、CPU 时间与内存峰值
+    result = materialize(assets, tags={PROFILE_TAG: "1"})
+    assert result.success
+    for ev in result.get_asset_materialization_events():
+        md = ev.materialization.metadata
+        folded = pathlib.Path(md["profile_folded"].value)
+        assert folded.is_file()
+        assert folded.parts[-3:-1] == ("profiles", result.run_id)
+        assert md["profile_peak_mem_mb"].value >= 0
+        assert md["profile_cpu_s"].value >= 0
+        # 业务元数据保持不变
+        assert {"count", "input_count"} & set(md)
@@ -3,6 +3,8 @@ from __future__ import annotations
 import pathlib
 import sys
 
+import pytest
+
 # 确保 src 在测试导入路径中（避免依赖可编辑安装）
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
 
@@ -31,6 +33,44 @@ def test_mlflow_stub_resource_logs():
     assert r.runs[-1]["active"] is False
 
 
+def test_mlflow_stub_resource_metric_series_and_eviction(tmp_path):
+    db = tmp_path / "stub.sqlite"
+    r = MlflowStubResource(max_runs=2, sqlite_path=str(db))
+    first = r.start_run()
+    for step in range(5):
+        r.log_metric("loss", 1.0 / (step + 1))
+    # 嵌套 run：关闭后回到外层 run 继续记录
+    inner = r.start_run()
+    r.log_param("inner", True)
+    r.log_metric("acc", 0.9)
+    r.close_run(inner)
+    r.log_param("outer", True)
+    r.close_run(first)
+    assert r.get_metric_history(first, "loss") == [1.0, 0.5, 1 / 3, 0.25, 0.2]
+
+    # 超出 max_runs 后淘汰最早关闭的 run，但仍可从 SQLite 查询
+    r.close_run(r.start_run())
+    assert len(r.runs) == 2
+    assert [x["run_id"] for x in r.runs] == [first, "run-3"]
+    assert r.get_metric_history(inner, "acc") == [0.9]
+    # 已关闭的 run 淘汰完后，活跃 run 不会被淘汰
+    for _ in range(3):
+        r.start_run()
+    assert len(r.runs) == 3 and all(x["active"] for x in r.runs)
+
+    # 共享同一文件的实例交替创建 run：编号不与仍活跃的 run 冲突，关闭时互不覆盖
+    other = MlflowStubResource(sqlite_path=str(db))
+    issued = [x["run_id"] for x in r.runs] + [first, inner]
+    for _ in range(3):
+        issued += [other.start_run(), r.start_run()]
+    assert len(issued) == len(set(issued))
+    other.log_metric("loss", 7.0)
+    other.close_run(issued[-2])
+    fresh = MlflowStubResource(sqlite_path=str(db))
+    assert fresh.get_metric_history(first, "loss") == [1.0, 0.5, 1 / 3, 0.25, 0.2]
+    assert fresh.get_metric_history(issued[-2], "loss") == [7.0]
+
+
 def test_mlflow_tracking_resource_min_api(monkeypatch):
     """使用 monkeypatch 模拟 mlflow 客户端，验证 Tracking 资源的最小 API 行为。
 
@@ -92,3 +132,497 @@ def test_mlflow_tracking_resource_min_api(monkeypatch):
     assert any(c[0] == "log_param" for c in fake.calls)
     assert any(c[0] == "log_metric" for c in fake.calls)
     assert any(c[0] == "end_run" for c in fake.calls)
+
+
+def test_local_vector_index_resource(tmp_path):
+    from dagma.defs.llm.resources import LocalVectorIndexResource
+
+    base = BasePathResource(base_path=str(tmp_path))
+    r = LocalVectorIndexResource(base_path=base, collection="t")
+    r.ensure_collection(size=2, distance="Cosine")
+    r.upsert(
+        [
+            {"id": 1, "vector": [1.0, 0.0], "payload": {"text": "a"}},
+            {"id": 2, "vector": [0.0, 1.0], "payload": {"text": "b"}},
+        ]
+    )
+    # 同 id 覆盖：2 号点改为与查询同向
+    r.upsert([{"id": 2, "vector": [1.0, 0.1], "payload": {"text": "b2"}}])
+    res = r.search([1.0, 0.1], limit=2)
+    assert [x["id"] for x in res] == [2, 1]
+    assert res[0]["payload"] == {"text": "b2"}
+    assert abs(res[0]["score"] - 1.0) < 1e-5
+    # 同一批内重复的新 id：以最后一条为准
+    r.upsert(
+        [
+            {"id": 3, "vector": [0.0, 1.0], "payload": {"text": "c"}},
+            {"id": 3, "vector": [-1.0, 0.0], "payload": {"text": "c2"}},
+        ]
+    )
+    assert r.search([-1.0, 0.0], limit=1)[0]["payload"] == {"text": "c2"}
+    assert len(r.search([1.0, 0.0], limit=10)) == 3
+
+    # 持久化：新实例可直接检索
+    r2 = LocalVectorIndexResource(base_path=base, collection="t")
+    assert r2.search([1.0, -1.0], limit=1)[0]["id"] == 1
+    # 幂等创建
+    assert r2.ensure_collection(size=2, distance="Cosine")["status"]["message"]
+
+
+def test_local_vector_index_recovers_from_interrupted_append(tmp_path):
+    from dagma.defs.llm.resources import LocalVectorIndexResource
+
+    base = BasePathResource(base_path=str(tmp_path))
+    r = LocalVectorIndexResource(base_path=base, collection="t")
+    r.ensure_collection(size=2, distance="Euclid")
+    r.upsert([{"id": 1, "vector": [0.0, 0.0]}])
+    assert r.collection_url("/points").endswith("/vector_index/t/points")
+    # 模拟上次写入在替换 meta.json 前中断：向量与 ids 多出未提交的尾部
+    with open(tmp_path / "vector_index" / "t" / "vectors.f32", "ab") as f:
+        f.write(b"\0" * 8 * 3)
+    (tmp_path / "vector_index" / "t" / "ids.json").write_text("[1, 99]", encoding="utf-8")
+    r.upsert([{"id": 2, "vector": [5.0, 5.0]}])
+    hits = r.search([5.0, 5.0], limit=2)
+    assert [h["id"] for h in hits] == [2, 1] and hits[0]["score"] < 1e-6
+
+    # 切换为 hnsw 后无需重新写入：首次检索时按当前向量惰性构建索引
+    pytest.importorskip("hnswlib")
+    h = LocalVectorIndexResource(base_path=base, collection="t", index_type="hnsw")
+    assert [x["id"] for x in h.search([5.0, 5.0], limit=2)] == [2, 1]
+    h.upsert([{"id": 3, "vector": [9.0, 9.0]}])
+    assert [p.name for p in (tmp_path / "vector_index" / "t").glob("hnsw*.bin")] == ["hnsw-3.bin"]
+
+
+def test_local_vector_index_ivf_matches_flat(tmp_path):
+    import numpy as np
+
+    from dagma.defs.llm.resources import LocalVectorIndexResource
+
+    base = BasePathResource(base_path=str(tmp_path))
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(200, 8)).astype("float32")
+    points = [{"id": i, "vector": v.tolist()} for i, v in enumerate(vecs)]
+    flat = LocalVectorIndexResource(base_path=base, collection="flat")
+    ivf = LocalVectorIndexResource(
+        base_path=base,
+        collection="ivf",
+        index_type="ivf",
+        ivf_min_points=10,
+        ivf_nprobe=8,
+        ivf_nlist=8,
+    )
+    for r in (flat, ivf):
+        r.ensure_collection(size=8, distance="Euclid")
+        r.upsert(points)
+    # nprobe == nlist 时 IVF 等价于暴力检索
+    q = vecs[0].tolist()
+    assert [x["id"] for x in ivf.search(q, limit=5)] == [x["id"] for x in flat.search(q, limit=5)]
+    assert flat.search(q, limit=1)[0]["id"] == 0
+
+
+def test_cached_langflow_resource(tmp_path, monkeypatch):
+    from dagma.defs.llm.resources import CachedLangflowResource, LangflowRestResource
+
+    calls = []
+
+    def fake_request(self, method, path, body=None):
+        calls.append(body["input_value"])
+        return {"id": len(calls), "echo": body["input_value"]}
+
+    monkeypatch.setattr(LangflowRestResource, "_request", fake_request)
+    r = CachedLangflowResource(
+        base_path=BasePathResource(base_path=str(tmp_path)),
+        default_flow_id="flow-1",
+        similarity_threshold=0.9,
+    )
+    first = r.run_flow(input_value="Summarize  the quarterly report")
+    # 归一化后完全相同：精确命中
+    assert r.run_flow(input_value="  summarize the quarterly report ") == first
+    # 近似输入：语义命中
+    assert r.run_flow(input_value="summarize the quarterly report!") == first
+    # 不同 tweaks 属于不同 scope，不命中
+    r.run_flow(input_value="summarize the quarterly report", tweaks={"temp": 0})
+    # 携带 session_id 时透传
+    r.run_flow(input_value="summarize the quarterly report", session_id="s1")
+    assert len(calls) == 3
+
+    stats = r.cache_stats()
+    assert (stats["hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["entries"] == 2
+    assert 0.49 < stats["hit_rate"] < 0.51
+
+
+def test_cached_langflow_resource_eviction(tmp_path, monkeypatch):
+    from dagma.defs.llm.resources import CachedLangflowResource, LangflowRestResource
+
+    monkeypatch.setattr(
+        LangflowRestResource, "_request", lambda self, m, p, body=None: {"v": body["input_value"]}
+    )
+    r = CachedLangflowResource(
+        base_path=BasePathResource(base_path=str(tmp_path)),
+        default_flow_id="flow-1",
+        cache_max_entries=2,
+    )
+    for text in ["a", "b", "c"]:
+        r.run_flow(input_value=text)
+    stats = r.cache_stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_mlflow_local_first_resource_offline_then_sync(tmp_path, monkeypatch):
+    """本地优先模式：训练期仅写本地文件；同步时通过 log_batch 批量回放。"""
+    import json
+    from types import SimpleNamespace
+
+    from dagma.defs.models.resources import MlflowLocalFirstResource
+
+    calls = []
+    # 第一次写指标批次时失败一次，模拟远端瞬时故障
+    failures = [True]
+
+    class _Client:
+        def __init__(self, tracking_uri=None):
+            calls.append(("client", tracking_uri))
+
+        def get_experiment_by_name(self, name):
+            return None
+
+        def create_experiment(self, name):
+            calls.append(("create_experiment", name))
+            return "exp-1"
+
+        def search_runs(self, experiment_ids, filter_string="", max_results=1):
+            return []
+
+        def create_run(self, experiment_id, start_time=None, tags=None):
+            calls.append(("create_run", experiment_id, tags["dagma.local_run_id"]))
+            return SimpleNamespace(info=SimpleNamespace(run_id="remote-1"))
+
+        def log_batch(self, run_id, metrics=(), params=()):
+            if failures and metrics:
+                failures.pop()
+                raise ConnectionError("transient")
+            calls.append(("log_batch", run_id, len(metrics), len(params)))
+
+        def log_artifact(self, run_id, local_path, artifact_path=None):
+            calls.append(("log_artifact", run_id))
+
+        def set_terminated(self, run_id, status=None, end_time=None):
+            calls.append(("set_terminated", run_id, status))
+
+    fake = SimpleNamespace(
+        tracking=SimpleNamespace(MlflowClient=_Client),
+        entities=SimpleNamespace(
+            Metric=lambda k, v, ts, step: (k, v, ts, step), Param=lambda k, v: (k, v)
+        ),
+    )
+    monkeypatch.setattr(MlflowTrackingResource, "_mlflow", staticmethod(lambda: fake))
+
+    r = MlflowLocalFirstResource(
+        base_path=BasePathResource(base_path=str(tmp_path)),
+        remote_tracking_uri="http://mlflow:5000",
+        experiment_name="Default",
+        fsync_every=4,
+        sync_async=False,
+    )
+    rid = r.start_run()
+    r.log_param("alpha", 0.1)
+    for step in range(1500):
+        r.log_metric("loss", 1.0 / (step + 1))
+    artifact = tmp_path / "summary.txt"
+    artifact.write_text("ok", encoding="utf-8")
+    r.log_artifact(str(artifact))
+    # 训练期间不产生任何远端调用
+    assert calls == []
+    r.close_run(rid)
+    # 首次同步在指标批次失败：保留进度，不写 .synced
+    assert not (tmp_path / "mlflow_local" / "runs" / f"{rid}.synced").exists()
+    assert r.sync_pending() == {rid: "remote-1"}
+
+    lines = (tmp_path / "mlflow_local" / "runs" / f"{rid}.jsonl").read_text().splitlines()
+    assert json.loads(lines[-1])["t"] == "end"
+    assert (tmp_path / "mlflow_local" / "runs" / f"{rid}.synced").read_text() == "remote-1"
+    # 1 批参数 + 2 批指标（单批上限 1000）
+    batches = [c for c in calls if c[0] == "log_batch"]
+    assert [(c[2], c[3]) for c in batches] == [(0, 1), (1000, 0), (500, 0)]
+    assert ("log_artifact", "remote-1") in calls
+    # 重试从断点续传：只创建一个远端 run，参数与指标不重复写入
+    assert [c[0] for c in calls].count("create_run") == 1
+    assert not (tmp_path / "mlflow_local" / "runs" / f"{rid}.progress").exists()
+    assert ("set_terminated", "remote-1", "FINISHED") in calls
+    # 已同步的 run 不会重复回放
+    assert r.sync_pending() == {}
+
+    runs_dir = tmp_path / "mlflow_local" / "runs"
+    # 仍在写入的 run（写入方持有锁）不同步；其他回放方持有锁时同样跳过
+    live = r.start_run()
+    r.log_metric("loss", 0.5)
+    assert r.sync_pending() == {}
+    r._fh.flush()
+    # 写入进程崩溃：锁随进程释放，缺少 end 记录与半行数据的 run 以 FAILED 结束后同步
+    r._fh.write('{"t": "metr')
+    r._fh.close()
+    r._lock_fh.close()
+    r._fh = r._lock_fh = r._active_run_id = None
+    with MlflowLocalFirstResource._claim(runs_dir / f"{live}.jsonl") as claimed:
+        assert claimed and r.sync_pending() == {}
+    assert r.sync_pending() == {live: "remote-1"}
+    assert ("set_terminated", "remote-1", "FAILED") in calls
+
+    # 后台同步为守护线程，并登记到退出时的有界等待
+    from dagma.defs.models import resources as model_resources
+    from dagma.defs.models.sensors import mlflow_local_sync_sensor
+
+    r_async = MlflowLocalFirstResource(
+        base_path=BasePathResource(base_path=str(tmp_path)),
+        remote_tracking_uri="http://mlflow:5000",
+        sync_exit_timeout_s=1.0,
+    )
+    r_async.close_run(r_async.start_run())
+    t, timeout = model_resources._background_syncs[-1]
+    assert t.daemon and timeout == 1.0
+    r_async.wait_for_sync(5)
+    assert r_async.sync_pending() == {}
+
+    # 无后续 close_run 时由传感器补偿同步
+    from dagster import build_sensor_context
+
+    leftover = r_async.start_run()
+    r_async._fh.close()
+    r_async._lock_fh.close()
+    with build_sensor_context(resources={"mlflow": r_async}) as ctx:
+        assert "synced 1" in mlflow_local_sync_sensor(ctx).skip_message
+    assert (runs_dir / f"{leftover}.synced").exists()
+
+
+def test_sharded_qdrant_resource_scatter_gather(monkeypatch):
+    import math
+    import threading
+
+    from dagma.defs.llm.resources import (
+        QdrantHttpResource,
+        QdrantShardConfig,
+        ShardedQdrantResource,
+    )
+
+    # 内存版 Qdrant：按 (host, collection) 隔离存储，检索按创建时的距离返回
+    # 余弦相似度（越大越近）或 L2 距离（Euclid，越小越近）
+    store: dict[tuple[str, str], dict] = {}
+    distances: dict[tuple[str, str], str] = {}
+    lock = threading.Lock()
+
+    def fake_request(self, method, path, body=None):
+        key = (self.host, self.collection)
+        with lock:
+            pts = store.setdefault(key, {})
+            if method == "PUT" and path == f"/collections/{self.collection}":
+                distances[key] = body["vectors"]["distance"]
+                return {"result": True}
+            if path.endswith("/points?wait=true"):
+                for p in body["points"]:
+                    pts[p["id"]] = p
+                return {"status": "ok"}
+            if path.endswith("/points/delete?wait=true"):
+                for pid in body["points"]:
+                    pts.pop(pid, None)
+                return {"status": "ok"}
+            if path.endswith("/points/search"):
+                euclid = distances[key] == "Euclid"
+
+                def score(a, b):
+                    if euclid:
+                        return math.dist(a, b)
+                    dot = sum(x * y for x, y in zip(a, b, strict=True))
+                    return dot / (math.hypot(*a) * math.hypot(*b))
+
+                must = (body.get("filter") or {}).get("must", [])
+                hits = [
+                    {
+                        "id": p["id"],
+                        "score": score(p["vector"], body["vector"]),
+                        "payload": p["payload"],
+                    }
+                    for p in pts.values()
+                    if all(p["payload"].get(m["key"]) == m["match"]["value"] for m in must)
+                ]
+                hits.sort(key=lambda h: h["score"] if euclid else -h["score"])
+                return {"result": hits[: body["limit"]]}
+            return {"result": True}
+
+    monkeypatch.setattr(QdrantHttpResource, "_request", fake_request)
+    r = ShardedQdrantResource(
+        shards=[
+            QdrantShardConfig(host="h1", collection="c0"),
+            QdrantShardConfig(host="h2", collection="c1"),
+            QdrantShardConfig(host="h2", collection="c2"),
+        ],
+        routing="tenant",
+    )
+    r.ensure_collection(size=2)
+    points = [
+        {
+            "id": i,
+            "vector": [math.cos(i / 10), math.sin(i / 10)],
+            "payload": {"tenant": f"t{i % 4}"},
+        }
+        for i in range(40)
+    ]
+    resp = r.upsert(points)
+    assert sum(s["count"] for s in resp["shards"]) == 40
+    # 同一租户只落在一个分片
+    for t in range(4):
+        tenant_keys = {
+            k for k, pts in store.items() for p in pts.values() if p["payload"]["tenant"] == f"t{t}"
+        }
+        assert len(tenant_keys) == 1
+
+    # 扇出检索合并后的 top-k 与全量排序一致
+    q = [1.0, 0.05]
+    hits = r.search(q, limit=3)
+    assert [h["id"] for h in hits] == [0, 1, 2]
+    assert hits[0]["score"] >= hits[1]["score"] >= hits[2]["score"]
+    # 指定租户时只查询其所在分片
+    assert {h["payload"]["tenant"] for h in r.search(q, limit=5, tenant="t1")} == {"t1"}
+
+    # 租户变化后路由到新分片，旧分片中的副本被删除
+    moved = next(
+        t
+        for t in range(4)
+        if r.shard_for({"id": 5, "payload": {"tenant": f"t{t}"}}) != r.shard_for(points[5])
+    )
+    r.upsert([{**points[5], "payload": {"tenant": f"t{moved}"}}])
+    copies = [p for pts in store.values() for pid, p in pts.items() if pid == 5]
+    assert [c["payload"]["tenant"] for c in copies] == [f"t{moved}"]
+
+    # collection 距离与合并方向必须一致
+    with pytest.raises(ValueError, match="distance"):
+        r.ensure_collection(size=2, distance="Euclid")
+    euclid = ShardedQdrantResource(
+        shards=[QdrantShardConfig(host="h3", collection=f"e{i}") for i in range(3)],
+        distance="Euclid",
+    )
+    euclid.ensure_collection(size=2, distance="Euclid")
+    grid = [{"id": i, "vector": [float(i), float(i % 7)], "payload": {}} for i in range(30)]
+    euclid.upsert(grid)
+    assert len({k for k, pts in store.items() if k[0] == "h3" and pts}) == 3
+    # 跨分片合并取最近（距离最小）的 top-k，与全量暴力排序一致
+    qe = [12.2, 4.9]
+    expected = sorted(grid, key=lambda p: math.dist(p["vector"], qe))[:3]
+    hits = euclid.search(qe, limit=3)
+    assert [h["id"] for h in hits] == [p["id"] for p in expected]
+    assert hits[0]["score"] == pytest.approx(math.dist(expected[0]["vector"], qe))
+
+
+def test_qdrant_collection_options_and_drift(monkeypatch):
+    from dagma.defs.llm.resources import QdrantHttpResource
+
+    calls: list[tuple[str, dict | None]] = []
+    existing = {
+        "params": {"vectors": {"size": 4, "distance": "Cosine", "on_disk": False}},
+        "hnsw_config": {"m": 16, "ef_construct": 100},
+        "quantization_config": None,
+        "optimizer_config": {"indexing_threshold": 20000},
+    }
+
+    def fake_request(self, method, path, body=None):
+        calls.append((method, body))
+        if method == "PUT":
+            raise RuntimeError("Qdrant HTTP 409 Conflict: already exists")
+        if method == "GET":
+            return {"result": {"config": existing}}
+        return {"result": True}
+
+    monkeypatch.setattr(QdrantHttpResource, "_request", fake_request)
+    r = QdrantHttpResource(collection="docs", on_drift="update")
+    body = r.collection_config(4, hnsw_m=32, quantization="scalar", on_disk=True)
+    assert body["hnsw_config"] == {"m": 32}
+    assert body["quantization_config"]["scalar"]["type"] == "int8"
+
+    resp = r.ensure_collection(size=4, hnsw_m=32, quantization="scalar", on_disk=True)
+    assert set(resp["drift"]) == {
+        "vectors.on_disk",
+        "hnsw_config.m",
+        "quantization_config.scalar.type",
+        "quantization_config.scalar.quantile",
+        "quantization_config.scalar.always_ram",
+    }
+    # update 模式下可变项通过 PATCH 下发
+    method, patch = calls[-1]
+    assert method == "PATCH"
+    assert patch["hnsw_config"] == {"m": 32}
+    assert patch["vectors"] == {"": {"on_disk": True}}
+
+    # 维度变化不可在线更新
+    with pytest.raises(RuntimeError, match="immutable"):
+        r.ensure_collection(size=8)
+    # 配置一致时无漂移
+    assert QdrantHttpResource(collection="docs").ensure_collection(size=4)["drift"] == {}
+
+
+def test_embedding_cache_resource_hits_batches_and_eviction(tmp_path):
+    from dagma.defs.llm.resources import EmbeddingCacheResource
+
+    calls: list[list[str]] = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(t)), float(ord(t[0])), 0.5] for t in texts]
+
+    base = BasePathResource(base_path=str(tmp_path))
+    # 3 维 float32 每行 12 字节：max_bytes=48 即最多保留 4 条
+    cache = EmbeddingCacheResource(base_path=base, max_bytes=48, batch_size=2)
+    vecs, st = cache.get_or_embed(["a", "bb", "ccc", "a"], embed, model_id="m/1")
+    assert vecs.shape == (4, 3)
+    assert vecs[0].tolist() == vecs[3].tolist() == [1.0, 97.0, 0.5]
+    # 去重后 3 条未命中，按 batch_size=2 分两批计算
+    assert st == {"hits": 0, "misses": 3, "evictions": 0}
+    assert calls == [["a", "bb"], ["ccc"]]
+
+    # 跨实例（模拟新运行）只计算未命中的文本
+    cache = EmbeddingCacheResource(base_path=base, max_bytes=48, batch_size=2)
+    vecs, st = cache.get_or_embed(["ccc", "dddd", "a"], embed, model_id="m/1")
+    assert st["hits"] == 2 and st["misses"] == 1
+    assert calls[-1] == ["dddd"]
+    assert vecs[1].tolist() == [4.0, 100.0, 0.5]
+
+    # 超出容量按 LRU 淘汰最久未访问的 "bb"，空出的行被复用，文件不增长
+    _, st = cache.get_or_embed(["eeeee"], embed, model_id="m/1")
+    assert st["evictions"] == 1
+    stats = cache.stats("m/1")
+    assert stats["entries"] == 4 and stats["bytes"] == 48
+    assert stats["hits"] == 2 and stats["misses"] == 5
+    _, st = cache.get_or_embed(["bb"], embed, model_id="m/1")
+    assert st["misses"] == 1
+
+    # 不同模型互不共享
+    _, st = cache.get_or_embed(["a"], embed, model_id="m/2")
+    assert st["misses"] == 1
+    # 清洗后同名的 model_id 仍各自独立
+    _, st = cache.get_or_embed(["a"], embed, model_id="m_1")
+    assert st["misses"] == 1
+
+
+def test_embedding_cache_concurrent_eviction_returns_own_vectors(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from dagma.defs.llm.resources import EmbeddingCacheResource
+
+    def embed(texts):
+        return [[float(t.split("-")[1]), 1.0] for t in texts]
+
+    # 容量只有 4 行：并发运行不断淘汰并复用行号，读到的向量仍须属于请求的文本
+    cache = EmbeddingCacheResource(
+        base_path=BasePathResource(base_path=str(tmp_path)), max_bytes=32
+    )
+
+    def run(worker: int) -> None:
+        for i in range(30):
+            texts = [f"t-{(worker * 7 + i + j) % 10}" for j in range(3)]
+            vecs, _ = cache.get_or_embed(texts, embed, model_id="m")
+            assert vecs[:, 0].tolist() == [float(t.split("-")[1]) for t in texts]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(run, range(4)))
+    stats = cache.stats("m")
+    assert stats["entries"] <= 4 and stats["hits"] + stats["misses"] == 4 * 30 * 3
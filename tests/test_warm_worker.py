@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import multiprocessing
+import pathlib
+import socket
+import sys
+import time
+from types import SimpleNamespace
+
+# 确保 src 在测试导入路径中（避免依赖可编辑安装）
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from dagma.warm_worker import (  # noqa: E402
+    WARM_WORKER_TAG,
+    WarmWorkerPool,
+    WarmWorkerRunLauncher,
+    recycle_reason,
+)
+
+
+def test_recycle_reason():
+    assert recycle_reason(1, 100.0, max_runs_per_worker=2, max_rss_mb=512) is None
+    assert "max_runs_per_worker" in recycle_reason(2, 100.0, 2, 512)
+    assert "rss" in recycle_reason(1, 600.0, 2, 512)
+    # <= 0 表示不限制
+    assert recycle_reason(10_000, 1e6, 0, 0) is None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(port: int, out_dir: str) -> None:
+    import os
+    import threading
+
+    # 仅在子进程中替换 mlflow：记录运行遗留的活动 run 栈
+    stack: list[str] = []
+    sys.modules["mlflow"] = SimpleNamespace(  # type: ignore[assignment]
+        active_run=lambda: stack[-1] if stack else None,
+        end_run=lambda status="FINISHED": stack.pop(),
+    )
+
+    def execute(run_id: str) -> None:
+        out = pathlib.Path(out_dir)
+        # 上一次运行注入的环境变量与 mlflow 活动 run 不应泄漏到本次运行
+        leaked = "DAGMA_TEST_LEAK" in os.environ or bool(stack)
+        os.environ["DAGMA_TEST_LEAK"] = run_id
+        stack.append(run_id)
+        if run_id.startswith("fail"):
+            # 模拟 MLflow 后台同步：进程回收前须等它写完
+            def _sync() -> None:
+                time.sleep(0.5)
+                (out / f"{run_id}.synced").write_text("ok", encoding="utf-8")
+
+            threading.Thread(target=_sync, daemon=True).start()
+            raise RuntimeError("boom")
+        (out / run_id).write_text("leaked" if leaked else "clean", encoding="utf-8")
+
+    WarmWorkerPool(
+        host="127.0.0.1", port=port, workers=1, max_runs_per_worker=2, preload=(), execute=execute
+    ).serve_forever()
+
+
+def test_warm_worker_pool_recycles_and_launcher_falls_back(tmp_path, monkeypatch):
+    port = _free_port()
+    proc = multiprocessing.get_context("fork").Process(target=_serve, args=(port, str(tmp_path)))
+    proc.start()
+    try:
+        launcher = WarmWorkerRunLauncher(host="127.0.0.1", port=port, connect_timeout=5.0)
+        deadline = time.time() + 10
+        while True:
+            try:
+                first = launcher.dispatch("run-1")
+                break
+            except OSError:
+                assert time.time() < deadline
+                time.sleep(0.05)
+        second = launcher.dispatch("run-2")
+        failed = launcher.dispatch("fail-3")
+        fourth = launcher.dispatch("run-4")
+        # 单个工作进程执行满 2 次后退出；运行失败后立即退出，均由父进程补位
+        assert first["pid"] == second["pid"] != failed["pid"] != fourth["pid"]
+        assert [x["runs"] for x in (first, second, failed, fourth)] == [1, 2, 1, 1]
+        deadline = time.time() + 10
+        while len(list(tmp_path.iterdir())) < 4:
+            assert time.time() < deadline
+            time.sleep(0.05)
+        # 每次运行后还原 os.environ 与 mlflow 活动 run；退出前等待了后台同步线程
+        assert {p.name: p.read_text() for p in tmp_path.iterdir()} == {
+            "run-1": "clean",
+            "run-2": "clean",
+            "fail-3.synced": "ok",
+            "run-4": "clean",
+        }
+    finally:
+        proc.terminate()
+        proc.join(10)
+    assert proc.exitcode == 0
+
+    # 进程池不可达：记录引擎事件后回退到 DefaultRunLauncher
+    events, launched = [], []
+    instance = SimpleNamespace(
+        report_engine_event=lambda msg, run, cls: events.append(msg),
+        add_run_tags=lambda run_id, tags: events.append(tags),
+    )
+    launcher = WarmWorkerRunLauncher(
+        host="127.0.0.1", port=port, connect_timeout=0.5, job_names=["run_llm_rag_job"]
+    )
+    monkeypatch.setattr(WarmWorkerRunLauncher, "_instance", instance)
+    launcher._fallback = SimpleNamespace(launch_run=launched.append)
+    dispatched = []
+    original_dispatch = launcher.dispatch
+    launcher.dispatch = lambda run_id: dispatched.append(run_id) or original_dispatch(run_id)
+    for job in ("run_llm_rag_job", "run_models_train_job", "run_llm_rag_job"):
+        ctx = SimpleNamespace(dagster_run=SimpleNamespace(run_id=f"r-{job}", job_name=job))
+        launcher.launch_run(ctx)
+    assert len(launched) == 3
+    # 仅白名单内的作业尝试过预热进程池；不可达后退避期内不再逐次等待连接超时
+    assert dispatched == ["r-run_llm_rag_job"]
+    assert len(events) == 2 and all("falling back" in e for e in events)
+    assert not any(WARM_WORKER_TAG in e for e in events if isinstance(e, dict))
+
+
+def test_execute_failure_before_start_marks_run_failed(monkeypatch):
+    import dagster._cli.api
+    import pytest
+    from dagster import DagsterRunStatus, instance_for_test
+    from dagster._core.test_utils import create_run_for_test
+
+    from dagma import warm_worker
+
+    def boom(*_args, **_kwargs):
+        raise RuntimeError("code location failed to load")
+
+    monkeypatch.setattr(dagster._cli.api, "_execute_run_command_body", boom)
+    with instance_for_test() as instance:
+        monkeypatch.setattr(warm_worker, "_instance", instance)
+        run = create_run_for_test(
+            instance, job_name="run_llm_rag_job", status=DagsterRunStatus.STARTING
+        )
+        with pytest.raises(RuntimeError):
+            warm_worker.execute_run_in_process(run.run_id)
+        assert instance.get_run_by_id(run.run_id).status == DagsterRunStatus.FAILURE
+
+
+def test_warm_pool_jobs_execute_steps_in_process(tmp_path, monkeypatch):
+    from dagster import DagsterEventType, DagsterRunStatus, instance_for_test
+    from dagster._core.definitions.reconstruct import ReconstructableRepository
+
+    from dagma import warm_worker
+
+    monkeypatch.chdir(tmp_path)  # BasePathResource 默认写入工作目录下的 .dagma_data
+    recon_job = ReconstructableRepository.for_module(
+        "dagma.definitions", "defs", working_directory=str(tmp_path)
+    ).get_reconstructable_job("run_models_train_job")
+    with instance_for_test() as instance:
+        monkeypatch.setattr(warm_worker, "_instance", instance)
+        run = instance.create_run_for_job(
+            job_def=recon_job.get_definition(), job_code_origin=recon_job.get_python_origin()
+        )
+        assert warm_worker.execute_run_in_process(run.run_id) is True
+        assert instance.get_run_by_id(run.run_id).status == DagsterRunStatus.SUCCESS
+        # 步骤在工作进程内执行，不再为每个步骤新建子进程
+        starting = instance.get_records_for_run(
+            run.run_id, of_type=DagsterEventType.STEP_WORKER_STARTING
+        ).records
+        assert starting == []